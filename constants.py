@@ -1,8 +1,15 @@
 SUMMARY_FILENAME = 'biased-language-summary.json'
 CODECLIMATE_FILENAME = 'biased-language.codeclimate.json'
+ROLLUP_CONTENT = 'biased-language-rollup'
 BIASED_WORDS_FILE = 'word_list.csv'
 ERR_FILE = 'err_biased_lang.log'
 LOG_FILE = 'biased_language.log'
 EXCLUDE_FILE = '.biased_lang_exclude'
 RGIGNORE_FILE = '.rgignore'
 MAX_LINE_LEN = 150
+RG_MAX_ARGS_LEN = 100000
+# rg treats a file with a NUL byte in its first block as binary
+BINARY_CHECK_LEN = 8192
+ARCHIVE_EXTENSIONS = ('.zip', '.jar', '.war', '.whl', '.tar', '.tar.gz', '.tgz')
+ARCHIVE_MAX_MEMBER_SIZE = 10 * 1024 * 1024
+ARCHIVE_MAX_DEPTH = 2
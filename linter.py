@@ -0,0 +1,323 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+'''
+Library entry point for embedding the linter in other Python services.
+
+    from linter import scan
+
+    result = scan(['/path/to/repo'], ['master', 'slave'])
+    for occurrence in result:
+        print(occurrence.path, occurrence.line_number, occurrence.biased_word)
+    print(result.summary['total_lines_matched'])
+
+Nothing is printed, no files are written (not even .rgignore) and the
+process never exits: occurrences are streamed from ripgrep as they are
+found and the summary, in the same shape as biased-language-summary.json,
+is available once the iteration is done.
+'''
+
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from subprocess import Popen, PIPE, STDOUT
+import constants
+from utils import truncate_line, get_match_offsets, MatchAggregator
+from utils import open_csv, read_exclusions, chunk_files, combine_rg_summaries
+from utils import list_shard_files, has_nested_excludes
+
+WORD_LIST = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         constants.BIASED_WORDS_FILE)
+
+
+# One match of a term. `path` is relative to the scanned `root`, `line` is
+# stripped and cut down to snippets when longer than max_line_len and
+# `offsets` are the (start, end) byte offsets of each match in the raw
+# line. A plain namedtuple: typing is slow to import on the CLI's path.
+class Occurrence(namedtuple('Occurrence', [
+        'biased_word', 'path', 'line_number', 'line', 'line_truncated',
+        'fingerprint', 'offsets', 'root'], defaults=[''])):
+    __slots__ = ()
+
+    def to_codeclimate(self):
+        return {
+            'description': f'Biased term found: {self.biased_word}',
+            'location': {
+                'path': self.path,
+                'lines': {
+                    'begin': self.line_number
+                }
+            },
+            'fingerprint': self.fingerprint
+        }
+
+
+# Builds an Occurrence out of a ripgrep 'match' entry. `path` is the
+# search path rg was given, it prefixes every path rg reports. Lines are
+# never truncated when max_line_len is None.
+def parse_match(entry, biased_word, path, max_line_len=constants.MAX_LINE_LEN):
+    data = entry['data']
+    file_path = data['path']['text'][len(path)+1:]
+    line_number = data['line_number']
+    if 'bytes' in data['lines']:
+        line = data['lines']['bytes']
+    else:
+        line = data['lines']['text']
+    string = '%s-%s-%s-%s' % (biased_word, file_path, line_number, line)
+    fingerprint = hashlib.md5(string.encode('utf-8')).hexdigest()
+
+    raw_line, line = line, line.strip()
+    is_truncated = False
+    if max_line_len is not None and len(line) > max_line_len:
+        # reuse the offsets rg already found instead of rescanning,
+        # they only line up with the text when it wasn't base64'd
+        offsets = None
+        if 'text' in data['lines']:
+            offsets = get_match_offsets(data['submatches'], raw_line)
+        line = truncate_line(line, biased_word, max_line_len, offsets)
+        is_truncated = True
+
+    return Occurrence(
+        biased_word=biased_word,
+        path=file_path,
+        line_number=line_number,
+        line=line,
+        line_truncated=is_truncated,
+        fingerprint=fingerprint,
+        offsets=tuple((submatch['start'], submatch['end'])
+                      for submatch in data['submatches']))
+
+
+def rg_search(biased_word, path, files=None, rg_options=()):
+    return list(rg_search_iter(biased_word, path, files, rg_options))
+
+
+# Extra rg arguments from the CLI args or scan() options, e.g. max_file_size
+def get_rg_options(args):
+    rg_options = []
+    if args.get('max_file_size'):
+        rg_options += ['--max-filesize', args['max_file_size']]
+    if args.get('scan_archives'):
+        # their members are searched by the ArchiveScanner instead
+        for extension in constants.ARCHIVE_EXTENSIONS:
+            rg_options += ['--iglob', f'!*{extension}']
+    return rg_options
+
+
+# Yields rg's output lines as they are printed. Closing the generator
+# early kills rg, which is how fail-fast and the match caps stop a search.
+# A governor kills it once the term's time is up. rg runs in `cwd`, which
+# its --glob patterns are relative to. The term is passed with -e, never
+# through a shell, so it is only ever read as a pattern.
+def rg_search_iter(biased_word, path, files=None, rg_options=(), governor=None,
+                   cwd=None):
+    if governor is not None:
+        governor.start_search()
+    rg_command = ['rg', '--ignore-case', '--hidden', '--json', *rg_options,
+                  '-e', biased_word, '--']
+    if files is None:
+        yield from stream_output(rg_command + [path], governor, cwd)
+        return
+
+    # explicit file list (sharded runs): search it in ARG_MAX sized chunks
+    # and fold the per-chunk summaries into a single one
+    summaries = []
+    for chunk in chunk_files(files, constants.RG_MAX_ARGS_LEN):
+        for result in stream_output(rg_command + chunk, governor, cwd):
+            if '"type":"summary"' in result:
+                summaries.append(json.loads(result))
+            else:
+                yield result
+            if result == KILLED:
+                # the term's time is up, the other chunks aren't searched
+                return
+    yield json.dumps(combine_rg_summaries(summaries))
+
+
+# Entry following the output of a search killed by the governor
+KILLED = json.dumps({'type': 'killed'})
+
+
+# Streams the output lines of `command`, an argv list, with its errors
+# mixed in. When the governor kills the command, a last KILLED entry
+# tells the readers that its output stops short.
+def stream_output(command, governor=None, cwd=None):
+    process = Popen(command, stdout=PIPE, stderr=STDOUT, cwd=cwd,
+                    encoding='utf-8', errors='replace')
+    timer, killed = None, threading.Event()
+    timeout = governor.search_timeout() if governor is not None else None
+    if timeout is not None:
+        def on_timeout():
+            governor.search_timed_out()
+            killed.set()
+            process.kill()
+        timer = threading.Timer(timeout, on_timeout)
+        timer.start()
+    try:
+        for line in process.stdout:
+            yield line.rstrip('\n')
+        if killed.is_set():
+            yield KILLED
+    finally:
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+
+# Reads the rg --json output of one term, as rg_search_iter yields it:
+# iterating gives each match entry with its Occurrence, `stats` holds rg's
+# totals once read (None when the search was stopped before them) and
+# `killed` whether the governor cut it short. Lines that aren't JSON are
+# rg's errors and go to `on_error`.
+class RgOutput(object):
+    def __init__(self, results, biased_word, path,
+                 max_line_len=constants.MAX_LINE_LEN, on_error=None):
+        self._results = results
+        self._biased_word = biased_word
+        self._path = path
+        self._max_line_len = max_line_len
+        self._on_error = on_error
+        self.stats = None
+        self.killed = False
+
+    def __iter__(self):
+        for result in self._results:
+            try:
+                entry = json.loads(result)
+            except ValueError:
+                if self._on_error is not None:
+                    self._on_error(result)
+                continue
+            if entry['type'] == 'killed':
+                # whatever totals come after only cover what was searched
+                self.killed = True
+            elif entry['type'] == 'summary':
+                self.stats = entry['data']['stats']
+            elif entry['type'] == 'match':
+                yield entry, parse_match(entry, self._biased_word, self._path,
+                                         self._max_line_len)
+
+
+class ScanResult(object):
+    def __init__(self, paths, rules, options):
+        self._paths = paths
+        self._rules = rules
+        self._max_line_len = options.get('max_line_len', constants.MAX_LINE_LEN)
+        self._use_exclude_file = options.get('exclude_file', True)
+        self._max_file_size = options.get('max_file_size')
+        self._rg_options = get_rg_options(options)
+        self._summary = None
+        self._iterator = self._scan()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    # The summary is built while iterating; asking for it early finishes
+    # the scan and drops the occurrences that weren't consumed yet.
+    @property
+    def summary(self):
+        if self._summary is None:
+            for _ in self._iterator:
+                pass
+        return self._summary
+
+    def close(self):
+        self._iterator.close()
+
+    def _scan(self):
+        summary = {'biased_words': []}
+        words = {}
+        total_lines = 0
+        aggregators = []
+        for root in self._paths:
+            root = root.rstrip('/') or '/'
+            # rg runs inside the root so the exclusion globs apply relative
+            # to it, like the .rgignore the CLI writes
+            search_path = os.path.abspath(root)
+            aggregator = MatchAggregator(search_path)
+            aggregators.append(aggregator)
+            exclusions = read_exclusions(
+                root, constants.EXCLUDE_FILE if self._use_exclude_file else None)
+            rg_options = list(self._rg_options)
+            for excluded in exclusions:
+                rg_options += ['--glob', '!' + excluded]
+            files = None
+            if self._use_exclude_file and has_nested_excludes(search_path):
+                # rg can't read those, it searches the walked files instead
+                files = list_shard_files(search_path, 1, 1, exclusions,
+                                         self._max_file_size)
+            for biased_word in self._rules:
+                word = words.setdefault(biased_word, {
+                    'biased_word': biased_word, 'num_matched_lines': 0,
+                    'num_matched_words': 0, 'num_matched_files': 0, 'files': []})
+                errors = []
+                output = RgOutput(rg_search_iter(biased_word, search_path, files,
+                                                 rg_options, cwd=search_path),
+                                  biased_word, search_path, self._max_line_len,
+                                  errors.append)
+                matched_files = set()
+                for entry, occurrence in output:
+                    if occurrence.path not in matched_files:
+                        matched_files.add(occurrence.path)
+                        word['files'].append(os.path.join(root, occurrence.path))
+                        word['num_matched_files'] += 1
+                    aggregator.add(biased_word, entry['data']['path']['text'],
+                                   1, len(entry['data']['submatches']))
+                    total_lines += 1
+                    yield occurrence._replace(root=root)
+                if errors:
+                    # rg exits with an error for those, a summary without
+                    # them would pass for a clean scan
+                    raise Exception(f'rg failed searching {root} for "{biased_word}":\n'
+                                    + '\n'.join(errors))
+                if output.stats is not None:
+                    word['num_matched_lines'] += output.stats['matched_lines']
+                    word['num_matched_words'] += output.stats['matches']
+
+        for biased_word in self._rules:
+            summary['biased_words'].append(biased_word)
+            word = words.get(biased_word)
+            summary[biased_word] = word if word and word['files'] else {}
+        summary['terms_found'] = total_lines > 0
+        summary['total_lines_matched'] = total_lines
+        summary['total_words_matched'] = sum(
+            word['num_matched_words'] for word in words.values())
+        summary['total_files_matched'] = sum(
+            aggregator.total_files_matched for aggregator in aggregators)
+        self._summary = summary
+
+
+def load_rules(word_list=WORD_LIST):
+    return [row[0] for row in open_csv(word_list) if row]
+
+
+# paths: directories to scan. rules: biased words, defaults to the
+# word_list.csv shipped with the linter. options:
+#   max_line_len  - longer lines are cut down to snippets (150)
+#   exclude_file  - honour each path's .biased_lang_exclude files, the
+#                   nested ones included (True)
+#   max_file_size - larger files are skipped, in rg's --max-filesize format
+def scan(paths, rules=None, options=None):
+    if isinstance(paths, str):
+        paths = [paths]
+    return ScanResult(list(paths), rules or load_rules(), options or {})
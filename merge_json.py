@@ -0,0 +1,73 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+'''
+Combines the JSON output of a sharded run (run_json.py --shard i/N) into the
+summary and codeclimate files a single run would have produced.
+
+    python3 merge_json.py --err_file=err_biased_lang.log shard-1/ shard-2/ ...
+
+Each directory holds the biased-language-summary.json and
+biased-language.codeclimate.json written by one shard.
+'''
+
+import argparse
+import constants
+import json
+import os
+import sys
+from run_json import report_result, exit_on_error
+from utils import merge_summaries, merge_codeclimate, write_file
+
+
+def build_merge_args_dict(args=None):
+    if not args:
+        args = sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('shard_dirs', nargs='+')
+    parser.add_argument('--err_file')
+    args = parser.parse_args(args)
+    if args.err_file and os.path.exists(args.err_file):
+        os.remove(args.err_file)
+    return {
+        'shard_dirs': args.shard_dirs,
+        'err_file': args.err_file,
+        'github_repo': os.environ.get('GITHUB_REPO')
+    }
+
+
+def read_json(file):
+    with open(file) as fp:
+        return json.load(fp)
+
+
+def merge(args):
+    summaries, reports = [], []
+    for shard_dir in args['shard_dirs']:
+        summaries.append(
+            read_json(os.path.join(shard_dir, constants.SUMMARY_FILENAME)))
+        reports.append(
+            read_json(os.path.join(shard_dir, constants.CODECLIMATE_FILENAME)))
+
+    occurrences = merge_summaries(summaries)
+    print(json.dumps(occurrences, indent=2))
+    write_file(constants.SUMMARY_FILENAME, occurrences)
+    write_file(constants.CODECLIMATE_FILENAME, merge_codeclimate(reports))
+    report_result(occurrences['terms_found'], args['err_file'],
+                  occurrences.get('incomplete', False))
+    exit_on_error(args['err_file'], args['github_repo'])
+
+
+if __name__ == '__main__':
+    merge(build_merge_args_dict())
@@ -0,0 +1,64 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+'''
+Answers questions from the occurrence index written by run_json.py --db.
+
+    python3 query_db.py --db=biased-lang.db terms
+    python3 query_db.py --db=biased-lang.db paths --term=whitelist
+    python3 query_db.py --db=biased-lang.db trend --repo=splunk/biased-lang
+
+terms and paths count the last run of each repo, trend lists every run.
+'''
+
+import argparse
+import json
+import os
+import sys
+from utils import OccurrenceDB
+
+
+def build_query_args_dict(args=None):
+    if not args:
+        args = sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query', choices=['terms', 'paths', 'trend'])
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--repo')
+    parser.add_argument('--term')
+    args = parser.parse_args(args)
+    if not os.path.exists(args.db):
+        raise Exception(f'No occurrence index found at {args.db}')
+    return {
+        'query': args.query,
+        'db': args.db,
+        'repo': args.repo,
+        'term': args.term
+    }
+
+
+def query(args):
+    db = OccurrenceDB(args['db'])
+    try:
+        if args['query'] == 'terms':
+            return db.term_counts(args['repo'])
+        if args['query'] == 'paths':
+            return db.path_counts(args['repo'], args['term'])
+        return db.trend(args['repo'], args['term'])
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    print(json.dumps(query(build_query_args_dict()), indent=2))
@@ -19,17 +19,18 @@ like GitHub Actions or GitLab CI.
 
 import argparse
 import constants
-import hashlib
 import json
 import os
 import sys
-from subprocess import getoutput
 from copy import copy
-from tools.event2splunk import Event2Splunk
-from utils import truncate_line, get_source_type, send_codeclimate_batch
+from linter import RgOutput, rg_search_iter, get_rg_options
+from utils import get_source_type, send_encoded_batch
+from utils import load_baseline, write_baseline, ResourceGovernor, ReportPipeline
+from utils import LineConsolidator
 from utils import open_csv, write_file, TimeFunction, process_and_return_exclusions
 from utils import get_hec_info, get_colors, get_batch_info, grab_repo_name
-from utils import BiasedLanguageLogger, get_line_count, is_json
+from utils import BiasedLanguageLogger, get_line_count, MatchAggregator
+from utils import parse_shard, list_shard_files, has_nested_excludes
 
 c = get_colors()['text']
 
@@ -50,6 +51,30 @@ def build_args_dict(args=None):
     parser.add_argument('--pz_endpoint')
     parser.add_argument('--pzero_token')
     parser.add_argument('--github_repo')
+    parser.add_argument('--dir_rollup', type=int)
+    parser.add_argument('--shard')
+    parser.add_argument('--splunk_ack', action='store_true')
+    parser.add_argument('--splunk_aggregate', action='store_true')
+    parser.add_argument('--splunk_sample', type=float)
+    parser.add_argument('--splunk_metrics_index')
+    parser.add_argument('--fail_fast', '--fail-fast', action='store_true')
+    parser.add_argument('--max_matches', '--max-matches', type=int)
+    parser.add_argument('--max_matches_per_term',
+                        '--max-matches-per-term', type=int)
+    parser.add_argument('--baseline')
+    parser.add_argument('--state_dir')
+    parser.add_argument('--max_file_size')
+    parser.add_argument('--time_budget', type=float)
+    parser.add_argument('--max_rss', type=int)
+    parser.add_argument('--term_timeout', type=float)
+    parser.add_argument('--db')
+    parser.add_argument('--splunk_delta', action='store_true')
+    parser.add_argument('--consolidate', action='store_true')
+    parser.add_argument('--scan_archives', action='store_true')
+    parser.add_argument('--max_archive_member_size', type=int)
+    parser.add_argument('--max_archive_depth', type=int)
+    parser.add_argument('--trigram_index')
+    parser.add_argument('--update_baseline', action='store_true')
     args = parser.parse_args(args)
     # args.path will be passed through GitLab CI and manual runs
     # GITHUB_WORKSPACE is env var set in GitHub Actions
@@ -58,6 +83,8 @@ def build_args_dict(args=None):
         raise Exception('No path specified')
     if path.endswith('/'):
         path = path[:-1]
+    if args.splunk_delta and not (args.state_dir or args.db):
+        raise Exception('--splunk_delta requires --state_dir or --db')
     if args.err_file:
         if not os.path.exists(args.err_file):
             sys.stdout.write('%sWarning: no file "%s" for error logs found. Defaulting to "%s". %s\n' % (
@@ -75,7 +102,30 @@ def build_args_dict(args=None):
         'splunk_token': args.splunk_token,
         'pz_endpoint': args.pz_endpoint,
         'pzero_token': args.pzero_token,
-        'github_repo': os.environ.get('GITHUB_REPO')
+        'github_repo': os.environ.get('GITHUB_REPO'),
+        'dir_rollup': args.dir_rollup,
+        'shard': args.shard,
+        'splunk_ack': args.splunk_ack,
+        'splunk_aggregate': args.splunk_aggregate,
+        'splunk_sample': args.splunk_sample,
+        'splunk_metrics_index': args.splunk_metrics_index,
+        'fail_fast': args.fail_fast,
+        'max_matches': args.max_matches,
+        'max_matches_per_term': args.max_matches_per_term,
+        'baseline': args.baseline,
+        'update_baseline': args.update_baseline,
+        'state_dir': args.state_dir,
+        'max_file_size': args.max_file_size,
+        'time_budget': args.time_budget,
+        'max_rss': args.max_rss,
+        'term_timeout': args.term_timeout,
+        'db': args.db,
+        'splunk_delta': args.splunk_delta,
+        'consolidate': args.consolidate,
+        'scan_archives': args.scan_archives,
+        'max_archive_member_size': args.max_archive_member_size,
+        'max_archive_depth': args.max_archive_depth,
+        'trigram_index': args.trigram_index
     }
 
 
@@ -86,63 +136,75 @@ output: more readable JSON summary
 '''
 
 
-def process_word_occurrences(results, batch_info, biased_word, path, splunk_flag):
+def process_word_occurrences(results, batch_info, biased_word, path, splunk_flag, aggregator=None, max_matches=None, baseline=None, governor=None, consolidator=None):
     json_result, report, events = {'biased_word': biased_word}, [], []
     files, lines = [], []
-
-    while len(results) > 0:
-        json_value = results.pop(0)
-        if not is_json(json_value):
+    num_matched_words = 0
+    # occurrences found in the baseline
+    suppressed_lines, suppressed_words = 0, 0
+    # a file only counts once one of its occurrences is collected, not
+    # when it is skipped by the baseline or the caps
+    reported_files = set()
+
+    # consolidated lines are only truncated once all terms are in
+    output = RgOutput(results, biased_word, path,
+                      None if consolidator is not None else constants.MAX_LINE_LEN,
+                      lambda error: print('Error parsing JSON: ', error))
+    for entry, match in output:
+        if governor is not None and governor.exhausted():
+            break
+        if baseline and match.fingerprint in baseline:
+            suppressed_lines += 1
+            suppressed_words += len(entry['data']['submatches'])
             continue
-        entry = json.loads(json_value)
-        is_truncated = False
-        if entry['type'] == 'summary':
-            json_result['num_matched_lines'] = entry['data']['stats']['matched_lines']
-            json_result['num_matched_words'] = entry['data']['stats']['matches']
-        if entry['type'] == 'begin':
-            # add to json_result
+        if max_matches is not None and len(report) >= max_matches:
+            # stop reading (and let rg stop searching), rg's totals
+            # will never come so report what was collected
+            json_result['max_matches_reached'] = True
+            json_result['num_matched_lines'] = len(report)
+            json_result['num_matched_words'] = num_matched_words
+            break
+        if entry['data']['path']['text'] not in reported_files:
+            reported_files.add(entry['data']['path']['text'])
             files.append(entry['data']['path']['text'])
-        if entry['type'] == 'match':
-            # add to code quality report
-            file_path = (entry['data']['path']['text'])[len(path)+1:]
-            line_number = entry['data']['line_number']
-            if 'bytes' in entry['data']['lines']:
-                line = entry['data']['lines']['bytes']
-            else:
-                line = entry['data']['lines']['text']
-            string = '%s-%s-%s-%s' % (biased_word,
-                                      file_path, line_number, line)
-
-            line = line.strip()
-
-            if len(line) > constants.MAX_LINE_LEN:
-                line = truncate_line(line, biased_word, constants.MAX_LINE_LEN)
-                is_truncated = True
-
-            location = {
-                'path': file_path,
-                'lines': {
-                    'begin': line_number
-                }
-            }
-            occurrence = {
-                'description': f'Biased term found: {biased_word}',
-                'location': location,
-                'fingerprint': hashlib.md5(string.encode('utf-8')).hexdigest()
+        num_matched_words += len(entry['data']['submatches'])
+        if aggregator is not None:
+            aggregator.add(biased_word, entry['data']['path']['text'],
+                           1, len(entry['data']['submatches']))
+        if consolidator is not None:
+            # the report gets one record per line after the scan
+            consolidator.add(match, entry)
+            report.append(match)
+            continue
+        # add to code quality report
+        occurrence = match.to_codeclimate()
+
+        report.append(occurrence)
+        # code quality events - additional details posted to Splunk
+        if splunk_flag:
+            splunk_info = {
+                'line_truncated': match.line_truncated,
+                'line': match.line,
+                'content': constants.CODECLIMATE_FILENAME
             }
-
-            report.append(occurrence)
-            # code quality events - additional details posted to Splunk
-            if splunk_flag:
-                splunk_info = {
-                    'line_truncated': is_truncated,
-                    'line': line,
-                    'content': constants.CODECLIMATE_FILENAME
-                }
-                splunk_info.update(batch_info)
-                splunk_info.update(occurrence)
-                events.append(splunk_info)
-
+            splunk_info.update(batch_info)
+            splunk_info.update(occurrence)
+            events.append(splunk_info)
+
+    if output.stats is not None and not output.killed:
+        json_result['num_matched_lines'] = output.stats['matched_lines']
+        json_result['num_matched_words'] = output.stats['matches']
+        if baseline is not None:
+            # rg's totals include the known occurrences
+            json_result['num_matched_lines'] -= suppressed_lines
+            json_result['num_matched_words'] -= suppressed_words
+    if baseline is not None:
+        json_result['num_suppressed_lines'] = suppressed_lines
+    if 'num_matched_lines' not in json_result:
+        # rg was stopped by a budget before its totals
+        json_result['incomplete'] = True
+        json_result['num_matched_lines'] = len(report)
+        json_result['num_matched_words'] = num_matched_words
     json_result['num_matched_files'] = len(files)
     json_result['files'] = files
     if lines:
@@ -150,13 +212,26 @@ def process_word_occurrences(results, batch_info, biased_word, path, splunk_flag
     return json_result, report, events
 
 
-def rg_search(biased_word, path):
-    rg_command = f'rg --ignore-case --hidden --json {biased_word} {path}'
-    output = getoutput(rg_command)
-    return output.splitlines()
+# Used by --fail-fast: returns the first match of any term, stopping rg
+# as soon as it reports one. Given an archive_scanner, looks through the
+# archive members it read instead.
+def find_first_match(lines, path, shard_files=None, baseline=None, rg_options=(),
+                     archive_scanner=None):
+    for line in lines:
+        if archive_scanner is not None:
+            results = archive_scanner.results(line[0])
+        else:
+            results = rg_search_iter(line[0], path, shard_files, rg_options)
+        try:
+            for _, match in RgOutput(results, line[0], path):
+                if not baseline or match.fingerprint not in baseline:
+                    return match
+        finally:
+            results.close()
+    return None
 
 
-def process_biased_word_line(line, occurrences, code_quality_report, splunk_events, args, batch_info, terms_found, logger):
+def process_biased_word_line(line, occurrences, code_quality_report, splunk_events, args, batch_info, terms_found, logger, aggregator=None, max_matches=None, governor=None, consolidator=None, archive_scanner=None, trigram_index=None):
     copy_occurrences = copy(occurrences)
     biased_word = line[0]
     json_results, word_report, events = {}, [], []
@@ -164,14 +239,43 @@ def process_biased_word_line(line, occurrences, code_quality_report, splunk_even
 
     rg_results_timer = TimeFunction(f'rg_search for {biased_word}', logger)
     rg_results_timer.start()
-    rg_results = rg_search(biased_word, args['path'])
+    files = args.get('shard_files')
+    if trigram_index is not None:
+        # only the files holding all the term's trigrams can match
+        candidates = trigram_index.candidates(biased_word)
+        if candidates is not None and archive_scanner is not None:
+            # the ArchiveScanner searches those
+            from utils import is_archive
+            candidates = [file for file in candidates if not is_archive(file)]
+        if candidates is not None and args.get('max_file_size'):
+            # rg doesn't apply --max-filesize to files given by name either
+            from utils import parse_file_size
+            limit = parse_file_size(args['max_file_size'])
+            candidates = [file for file in candidates if os.path.getsize(file) <= limit]
+        if candidates is not None:
+            files = candidates
+    rg_results = rg_search_iter(biased_word, args['path'], files,
+                                get_rg_options(args), governor)
+    if archive_scanner is not None:
+        rg_results = archive_scanner.results(biased_word, rg_results)
+    try:
+        word_results, word_report, events = process_word_occurrences(
+            rg_results, batch_info, biased_word, args['path'], args['splunk_flag'], aggregator, max_matches,
+            args.get('baseline_fingerprints'), governor, consolidator)
+    finally:
+        rg_results.close()
     rg_results_timer.stop()
 
-    # the data summary entry will always be there, hence the > 1
-    if len(rg_results) > 1:
-        json_results, word_report, events = process_word_occurrences(
-            rg_results, batch_info, biased_word, args['path'], args['splunk_flag'])
+    if word_results['files']:
+        json_results = word_results
         terms_found = True
+    elif word_results.get('incomplete'):
+        # stopped before its first match, not a term without any
+        json_results = word_results
+    if word_results.get('num_suppressed_lines'):
+        # kept even when every occurrence of the term is in the baseline
+        copy_occurrences['total_lines_suppressed'] = copy_occurrences.get(
+            'total_lines_suppressed', 0) + word_results['num_suppressed_lines']
 
     # add to code quality output and to Splunk events list
     for report in word_report:
@@ -184,13 +288,118 @@ def process_biased_word_line(line, occurrences, code_quality_report, splunk_even
 
     return terms_found, copy_occurrences
 
+# final error check, shared with merge_json.py. A scan cut short by a
+# limit is never reported as clean.
+def report_result(terms_found, err_file, incomplete=False):
+    if not terms_found and not incomplete:
+        sys.stdout.write('%sBiased Lang Linter %sfound no biased words! 🎉%s\n' % (
+            c['lightmagenta'], c['green'], c['nc']))
+    else:
+        if terms_found:
+            error_message = '%sError: %sBiased Lang Linter%s found biased words. Replacement(s) required. 🚨\nSee JSON output for details on what to replace. 🕵🏽‍♀️ %s\n' % (
+                c['red'], c['lightmagenta'], c['red'], c['nc'])
+        else:
+            error_message = '%sError: %sBiased Lang Linter%s stopped before the end of the scan, biased words may have been missed. 🚨\nSee "limits_hit" in the JSON output. %s\n' % (
+                c['red'], c['lightmagenta'], c['red'], c['nc'])
+        sys.stderr.write(error_message)
+        if err_file:
+            with open(err_file, 'w') as errfile:
+                errfile.write(error_message)
+
+
+# For GitHub Actions to provide error annotations
+def exit_on_error(err_file, github_repo):
+    if err_file and os.path.exists(err_file) and github_repo:
+        print(f'{err_file} file found, exiting(1)')
+        sys.exit(1)
+
+
+# Occurrences the next term may still collect under --max_matches and
+# --max_matches_per_term, None when uncapped
+def get_max_matches(args, num_collected):
+    max_matches = args.get('max_matches_per_term')
+    if args.get('max_matches') is not None:
+        remaining = max(args['max_matches'] - num_collected, 0)
+        if max_matches is None or remaining < max_matches:
+            max_matches = remaining
+    return max_matches
+
+
+# Gate-only runs: stop at the first match of any term and exit non-zero
+# without building any report. Returns when nothing was found.
+def fail_fast(lines, args, logger):
+    match = find_first_match(lines, args['path'], args.get('shard_files'),
+                             args.get('baseline_fingerprints'), get_rg_options(args))
+    if match is None and args.get('scan_archives'):
+        # archives are only opened once the plain files came up clean
+        match = find_first_match(lines, args['path'],
+                                 baseline=args.get('baseline_fingerprints'),
+                                 archive_scanner=scan_archives(args, lines, logger))
+    report_result(match is not None, args['err_file'])
+    if match is not None:
+        print(f'Biased term "{match.biased_word}" found in '
+              f'{match.path}:{match.line_number}, exiting(1)')
+        sys.exit(1)
+
+
+# --scan_archives: archive members are read once up front for all the terms
+def scan_archives(args, lines, logger, governor=None):
+    from utils import ArchiveScanner, find_archives
+    shard = parse_shard(args['shard']) if args.get('shard') else None
+    return ArchiveScanner(
+        [line[0] for line in lines],
+        args.get('max_archive_member_size') or constants.ARCHIVE_MAX_MEMBER_SIZE,
+        args.get('max_archive_depth') or constants.ARCHIVE_MAX_DEPTH,
+        logger).scan(find_archives(args['path'], shard), governor)
+
+
+# --splunk_aggregate: per-term, per-file and per-directory counts instead
+# of one event per occurrence, plus an optional sample of the occurrences
+def send_aggregated(args, aggregator, encoded_events, batch_info, repo_name, source_type, sinks):
+    from utils import build_rollups, sample_events, send_rollup_batch
+    rollups = build_rollups(aggregator, args.get('dir_rollup') or 1)
+    sampled = sample_events(encoded_events, args.get('splunk_sample') or 0,
+                            key=lambda pair: pair[0])
+    sampled = [encoded for _, encoded in sampled]
+    for event2splunk in sinks:
+        send_rollup_batch(rollups, batch_info, repo_name, source_type,
+                          event2splunk, args.get('splunk_metrics_index'))
+        if sampled:
+            send_encoded_batch(constants.CODECLIMATE_FILENAME, sampled,
+                               repo_name, source_type, event2splunk)
+
+
+# Delta emission keeps its state in --state_dir, or else in the --db index
+def get_delta_state(args, repo_name, db):
+    if args.get('state_dir'):
+        from utils import DeltaState
+        return DeltaState(args['state_dir'], repo_name)
+    if args.get('splunk_delta') and db is not None:
+        from utils import DBDeltaState
+        return DBDeltaState(db, repo_name)
+    return None
+
+
+# The snapshot only moves forward once both sinks have every event, a
+# failed upload is sent again as part of the next run's delta
+def save_delta_state(delta_state, code_quality_report, batch_info, sinks, logger):
+    if all(sink.ingested_events == sink.total_events for sink in sinks):
+        delta_state.save(code_quality_report, batch_info)
+    else:
+        logger.warning(f'Not all events reached Splunk, keeping {delta_state.path}')
+
+
 def main(args, logger):
     main_timer = TimeFunction('main', logger)
     main_timer.start()
     batch_info = get_batch_info()
     if args['splunk_flag'] and not args['github_repo']:
-        hec = get_hec_info(args['splunk_token'], args['h_endpoint'])
-        pzero_hec = get_hec_info(args['pzero_token'], args['pz_endpoint'])
+        # the HEC transport (ssl, urllib) is only loaded when posting
+        from tools.event2splunk import Event2Splunk
+        hec = get_hec_info(args['splunk_token'], args['h_endpoint'],
+                           args.get('splunk_ack'))
+        pzero_hec = get_hec_info(args['pzero_token'], args['pz_endpoint'],
+                                 args.get('splunk_ack'))
         event2splunk = Event2Splunk(hec, logger)
         pz_event2splunk = Event2Splunk(pzero_hec, logger)
     repo_name = args['github_repo'] or grab_repo_name(args['path'])
@@ -198,67 +407,204 @@ def main(args, logger):
     excluded = process_and_return_exclusions(
         args['path'], constants.EXCLUDE_FILE, constants.RGIGNORE_FILE)
     lines = open_csv('word_list.csv')
+    shard = parse_shard(args['shard']) if args.get('shard') else None
+    if shard is not None or has_nested_excludes(args['path']):
+        # a shard is a slice of the repo and rg doesn't read nested exclude
+        # files, rg is then given the walked files (a single shard holds
+        # all of them)
+        args = dict(args, shard_files=list_shard_files(
+            args['path'], *(shard or (1, 1)), max_file_size=args.get('max_file_size')))
+        if args.get('scan_archives'):
+            # get_rg_options' globs don't apply to files given by name
+            from utils import is_archive
+            args['shard_files'] = [file for file in args['shard_files']
+                                   if not is_archive(file)]
+    if args.get('update_baseline'):
+        if not args.get('baseline'):
+            raise Exception('--update_baseline requires --baseline')
+        # every current occurrence goes into the new baseline
+        args = dict(args, fail_fast=False, max_matches=None,
+                    max_matches_per_term=None, consolidate=False)
+    elif args.get('baseline'):
+        args = dict(args, baseline_fingerprints=load_baseline(args['baseline']))
 
     occurrences = {'biased_words': []}
     code_quality_report, splunk_events = [], []
     terms_found = False
+    aggregator = MatchAggregator(args['path'])
+
+    if args.get('fail_fast'):
+        fail_fast(lines, args, logger)
+        return
+
+    # occurrences go out one by one unless the delta or the rollups,
+    # which need the whole scan, are sent instead
+    stream_splunk = (args['splunk_flag'] and not args['github_repo']
+                     and not args.get('splunk_aggregate')
+                     and not args.get('state_dir') and not args.get('splunk_delta'))
+    governor = None
+    if any(args.get(limit) is not None
+           for limit in ('time_budget', 'max_rss', 'term_timeout')):
+        governor = ResourceGovernor(args.get('time_budget'), args.get('max_rss'),
+                                    args.get('term_timeout'))
+
+    if args['splunk_flag'] and not args.get('update_baseline'):
+        # counted in the background while the scan runs, within the same
+        # time budget
+        from concurrent.futures import ThreadPoolExecutor
+        line_counter = ThreadPoolExecutor(max_workers=1)
+        total_lines = line_counter.submit(
+            get_line_count, args['path'], excluded, args.get('max_file_size'),
+            governor.out_of_time if governor is not None else None)
+        line_counter.shutdown(wait=False)
+    consolidator = LineConsolidator() if args.get('consolidate') else None
+    pipeline = None
+    if not args.get('update_baseline'):
+        # writes the codeclimate file (and posts to Splunk) while scanning
+        pipeline = ReportPipeline(
+            constants.CODECLIMATE_FILENAME, batch_info,
+            encode_events=args['splunk_flag'] and not args['github_repo'],
+            sinks=[event2splunk, pz_event2splunk] if stream_splunk else (),
+            repo_name=repo_name, source_type=source_type)
+
+    archive_scanner = None
+    if args.get('scan_archives'):
+        archive_scanner = scan_archives(args, lines, logger, governor)
+
+    trigram_index = None
+    if args.get('trigram_index'):
+        from utils import TrigramIndex, walk_shard
+        trigram_index = TrigramIndex(args['trigram_index'], args['path'])
+        if trigram_index.update(walk_shard(args['path'], shard), args.get('max_file_size'),
+                                governor.out_of_time if governor is not None else None) is None:
+            # the files it didn't get to would be missed, this run searches
+            # every file and the next one carries on indexing
+            trigram_index.close()
+            trigram_index = None
 
     # Generate JSON
-    for line in lines:
+    max_matches_reached = False
+    terms_not_searched = []
+    for index, line in enumerate(lines):
+        if governor is not None and governor.exhausted():
+            # out of budget: report what was found so far
+            terms_not_searched = [line[0] for line in lines[index:]]
+            break
+        max_matches = get_max_matches(args, len(code_quality_report))
+        if max_matches == 0:
+            # nothing more can be collected, rg isn't even started
+            max_matches_reached = True
+            terms_not_searched = [line[0] for line in lines[index:]]
+            break
+        num_reported, num_events = len(code_quality_report), len(splunk_events)
         terms_found, occurrences = process_biased_word_line(
-            line, occurrences, code_quality_report, splunk_events, args, batch_info, terms_found, logger)
+            line, occurrences, code_quality_report, splunk_events, args, batch_info, terms_found, logger, aggregator, max_matches, governor, consolidator,
+            archive_scanner, trigram_index)
+        if pipeline is not None and consolidator is None:
+            pipeline.put(code_quality_report[num_reported:],
+                         splunk_events[num_events:])
+        if occurrences[line[0]].get('max_matches_reached'):
+            max_matches_reached = True
+
+    if trigram_index is not None:
+        trigram_index.close()
+    # every term is listed, merge_json relies on it
+    for word in terms_not_searched:
+        occurrences['biased_words'].append(word)
+        occurrences[word] = {}
+
+    if args.get('update_baseline'):
+        write_baseline(args['baseline'], [occurrence['fingerprint']
+                                          for occurrence in code_quality_report])
+        print(f'Wrote {len(code_quality_report)} fingerprints to {args["baseline"]}')
+        return
 
     occurrences['terms_found'] = terms_found
     occurrences['total_lines_matched'] = len(code_quality_report)
+    if consolidator is not None:
+        code_quality_report, splunk_events = consolidator.report(
+            batch_info, args['splunk_flag'])
+        pipeline.put(code_quality_report, splunk_events)
+        occurrences['total_lines_consolidated'] = len(code_quality_report)
+    _, encoded_events = pipeline.finish()
 
-    all_files_matched = []
     occurrences['total_words_matched'] = 0
     for word in occurrences['biased_words']:
         if word in occurrences and len(occurrences[word]) > 0:
             occurrences['total_words_matched'] += occurrences[word]['num_matched_words']
-            all_files_matched = list(
-                set(all_files_matched) | set(occurrences[word]['files']))
-    occurrences['total_files_matched'] = len(all_files_matched)
+    occurrences['total_files_matched'] = aggregator.total_files_matched
+    if args.get('dir_rollup'):
+        occurrences['directories'] = aggregator.directory_rollup(
+            args['dir_rollup'])
+    if args.get('shard'):
+        occurrences['shard'] = args['shard']
+    if max_matches_reached:
+        occurrences['max_matches_reached'] = True
+    if governor is not None and governor.limits_hit:
+        occurrences['incomplete'] = True
+        occurrences['limits_hit'] = governor.limits_hit
+        occurrences['terms_not_searched'] = terms_not_searched
+        sys.stderr.write('%sWarning: stopped by %s, results are incomplete.%s\n' % (
+            c['red'], ', '.join(governor.limits_hit), c['nc']))
+    elif terms_not_searched:
+        occurrences['terms_not_searched'] = terms_not_searched
+    if 'baseline_fingerprints' in args:
+        # moved next to the other totals
+        occurrences['total_lines_suppressed'] = occurrences.pop(
+            'total_lines_suppressed', 0)
 
     # print output to console
     print(json.dumps(occurrences, indent=2))
 
     write_file(constants.SUMMARY_FILENAME, occurrences)
-    write_file(constants.CODECLIMATE_FILENAME, code_quality_report)
     err_file = args['err_file']
-    # final error check
-    if not terms_found:
-        sys.stdout.write('%sBiased Lang Linter %sfound no biased words! 🎉%s\n' % (
-            c['lightmagenta'], c['green'], c['nc']))
-    else:
-        error_message = '%sError: %sBiased Lang Linter%s found biased words. Replacement(s) required. 🚨\nSee JSON output for details on what to replace. 🕵🏽‍♀️ %s\n' % (
-            c['red'], c['lightmagenta'], c['red'], c['nc'])
-        sys.stderr.write(error_message)
-        if err_file:
-            with open(err_file, 'w') as errfile:
-                errfile.write(error_message)
+    report_result(terms_found, err_file, occurrences.get('incomplete', False))
+
+    db = None
+    if args.get('db'):
+        from utils import OccurrenceDB
+        db = OccurrenceDB(args['db'])
+        db.record_run(repo_name, batch_info, occurrences, code_quality_report)
 
     if args['splunk_flag']:
         # Post the summarized JSON to Splunk
         occurrences['content'] = constants.SUMMARY_FILENAME
         occurrences.update(batch_info)
-        occurrences['total_lines'] = get_line_count(args['path'], excluded)
+        occurrences['total_lines'] = total_lines.result()
         occurrences['run_time'] = main_timer.stop()
         if not args['github_repo']:
-            send_codeclimate_batch(constants.CODECLIMATE_FILENAME, splunk_events,
-                                    repo_name, source_type, event2splunk)
-            send_codeclimate_batch(constants.CODECLIMATE_FILENAME, splunk_events,
-                                    repo_name, source_type, pz_event2splunk)
+            delta_state = get_delta_state(args, repo_name, db)
+            if not stream_splunk:
+                # (fingerprint, encoded payload) of each event to send
+                encoded_events = list(zip(
+                    [occurrence['fingerprint'] for occurrence in code_quality_report],
+                    encoded_events))
+                if delta_state is not None:
+                    # only what changed since the last run
+                    encoded_events, occurrences['delta'] = delta_state.diff(
+                        code_quality_report, [encoded for _, encoded in encoded_events],
+                        batch_info)
+                if args.get('splunk_aggregate'):
+                    send_aggregated(args, aggregator, encoded_events, batch_info,
+                                    repo_name, source_type, [event2splunk, pz_event2splunk])
+                else:
+                    encoded_events = [encoded for _, encoded in encoded_events]
+                    send_encoded_batch(constants.CODECLIMATE_FILENAME, encoded_events,
+                                       repo_name, source_type, event2splunk)
+                    send_encoded_batch(constants.CODECLIMATE_FILENAME, encoded_events,
+                                       repo_name, source_type, pz_event2splunk)
             event2splunk.post_event(payload=occurrences,
                                     source=repo_name, sourcetype=source_type)
             event2splunk.close(filename=constants.SUMMARY_FILENAME)
             pz_event2splunk.post_event(
                 payload=occurrences, source=repo_name, sourcetype=source_type)
             pz_event2splunk.close(filename=constants.SUMMARY_FILENAME)
-    # For GitHub Actions to provide error annotations
-    if os.path.exists(err_file) and args['github_repo']:
-        print(f'{err_file} file found, exiting(1)')
-        sys.exit(1)
+            if delta_state is not None:
+                save_delta_state(delta_state, code_quality_report, batch_info,
+                                 [event2splunk, pz_event2splunk], logger)
+    if db is not None:
+        db.close()
+    exit_on_error(err_file, args['github_repo'])
 
 
 if __name__ == '__main__':
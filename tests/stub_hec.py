@@ -0,0 +1,116 @@
+'''
+A local stand-in for the Splunk HTTP Event Collector, just enough of it to
+exercise the HEC client: event posts, channels and indexer acknowledgement.
+'''
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+EVENT_PATH = '/services/collector/event'
+ACK_PATH = '/services/collector/ack'
+
+
+def split_events(body):
+    decoder = json.JSONDecoder()
+    events, index = [], 0
+    while index < len(body):
+        event, index = decoder.raw_decode(body, index)
+        events.append(event)
+    return events
+
+
+class StubHEC(object):
+    def __init__(self, token='valid-token', ack=False, lost_acks=(),
+                 busy_responses=0, retry_after=0):
+        self.token = token
+        self.ack = ack
+        # ackIds that are never reported as indexed
+        self.lost_acks = set(lost_acks)
+        # number of posts answered with 503 before accepting data
+        self.busy_responses = busy_responses
+        self.retry_after = retry_after
+        self.events = []
+        self.requests = []
+        self.ack_queries = []
+        self._next_ack = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.01},
+                                        daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def splunk_env(self, **extra):
+        env = {
+            'hec_host': '127.0.0.1',
+            'hec_port': str(self.port),
+            'hec_key': f'Splunk {self.token}',
+            'hec_index': 'bias_language',
+            'hec_protocol': 'http',
+            'hec_ack': self.ack,
+        }
+        env.update(extra)
+        return env
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, path, query, headers, body):
+        if headers.get('Authorization') != f'Splunk {self.token}':
+            return 401, {'text': 'Invalid authorization', 'code': 3}, {}
+        channel = headers.get('X-Splunk-Request-Channel')
+        with self._lock:
+            if path == EVENT_PATH:
+                self.requests.append(channel)
+                if self.busy_responses > 0:
+                    self.busy_responses -= 1
+                    return 503, {'text': 'Server is busy', 'code': 9}, {
+                        'Retry-After': str(self.retry_after)}
+                if self.ack and not channel:
+                    return 400, {'text': 'Data channel is missing', 'code': 10}, {}
+                self.events.extend(split_events(body))
+                response = {'text': 'Success', 'code': 0}
+                if self.ack:
+                    ack_id = self._next_ack.get(channel, 0)
+                    self._next_ack[channel] = ack_id + 1
+                    response['ackId'] = ack_id
+                return 200, response, {}
+            if path == ACK_PATH and self.ack:
+                ack_ids = json.loads(body)['acks']
+                self.ack_queries.append((query.get('channel', [None])[0], ack_ids))
+                return 200, {'acks': {str(ack_id): ack_id not in self.lost_acks
+                                      for ack_id in ack_ids}}, {}
+        return 404, {'text': 'The requested URL was not found', 'code': 404}, {}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                status, response, headers = stub._handle(
+                    url.path, parse_qs(url.query), self.headers, body.decode())
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,15 +1,33 @@
 import json
 import os
+import io
+import subprocess
 import sys
+import tarfile
+import zipfile
 import pytest
 import constants
 from unittest.mock import patch
 from utils import process_and_return_exclusions, is_json, add_lines, rgignore_cleanup
 from utils import get_batch_info, truncate_line, get_source_type, open_csv, get_colors
 from utils import write_file, grab_repo_name, get_hec_info, TimeFunction, BiasedLanguageLogger
-from utils import get_line_count
-from run_json import main, rg_search, build_args_dict, process_word_occurrences, process_biased_word_line
+from utils import get_line_count, get_match_offsets, find_literal_offsets, MatchAggregator
+from utils import parse_shard, list_shard_files, merge_summaries, merge_codeclimate
+from utils import has_nested_excludes, parse_file_size
+from utils import build_rollups, sample_events, send_rollup_batch
+from utils import encode_occurrences, encode_splunk_events, write_encoded_list, send_encoded_batch
+from utils import load_baseline, write_baseline, DeltaState, ResourceGovernor
+from utils import OccurrenceDB, DBDeltaState, ReportPipeline, LineConsolidator
+from utils import ArchiveScanner, find_archives, TrigramIndex, Walker
+from query_db import query
+from run_json import main, build_args_dict, process_word_occurrences, process_biased_word_line
+from run_json import get_max_matches, find_first_match
+from linter import scan, Occurrence, rg_search, rg_search_iter, stream_output, get_rg_options
+from linter import KILLED
 from tools.event2splunk import Event2Splunk
+from tools.flowcontrol import FlowController, TokenBucket, parse_retry_after
+from tools.splunkhecclient import SplunkHECClient
+from tests.stub_hec import StubHEC
 
 c = get_colors()
 mock_repo_path = './tests/mock_repo'
@@ -56,6 +74,29 @@ def test_truncate_line():
     assert "Max length of lines reached" in max_truncated
 
 
+def test_truncate_line_with_offsets():
+    raw_line = '    ' + 'x' * 200 + 'Whitelist' + 'y' * 200
+    line = raw_line.strip()
+    submatches = [{'match': {'text': 'Whitelist'}, 'start': 204, 'end': 213}]
+    offsets = get_match_offsets(submatches, raw_line)
+    assert offsets == [(200, 209)]
+    truncated = truncate_line(line, 'whitelist', constants.MAX_LINE_LEN, offsets)
+    assert len(truncated) <= constants.MAX_LINE_LEN
+    assert 'Whitelist' in truncated
+
+    # byte offsets past multi-byte characters map back to text offsets
+    raw_line = 'é' * 10 + 'master'
+    submatches = [{'match': {'text': 'master'}, 'start': 20, 'end': 26}]
+    assert get_match_offsets(submatches, raw_line) == [(10, 16)]
+
+
+def test_find_literal_offsets():
+    line = 'a.b a+b A.B axb'
+    assert find_literal_offsets(line, 'a.b') == [(0, 3), (8, 11)]
+    assert find_literal_offsets(line, '') == []
+    assert len(find_literal_offsets('master ' * 20, 'master')) == 5
+
+
 def test_get_source_type():
     url = 'https://cd.splunkdev.com/engprod/biased-lang'
     source_type = get_source_type(url)
@@ -114,7 +155,10 @@ def test_build_args_dict():
         [f'--path={extra_slash_path}', '--url=https://cd.splunkdev.com/engprod/biased-lang', '--err_file=fake_file'])
     assert args['path'] == mock_repo_path
     assert args['err_file'] == constants.ERR_FILE
-    assert len(args) == 9
+    assert len(args) == 32
+    assert args['fail_fast'] == False
+    assert args['dir_rollup'] == None
+    assert args['shard'] == None
 
 
 def test_process_word_occurrences(batch_info):
@@ -137,6 +181,92 @@ def test_process_word_occurrences(batch_info):
     assert 'uuid' in events[0]
 
 
+def test_match_aggregator(batch_info):
+    aggregator = MatchAggregator(mock_repo_path)
+    for biased_word in ['whitelist', 'master']:
+        process_word_occurrences(rg_search(biased_word, mock_repo_path),
+                                 batch_info, biased_word, mock_repo_path, False, aggregator)
+    assert aggregator.total_files_matched == 3
+    matrix = aggregator.file_matrix()
+    assert matrix['biased_words.txt']['whitelist'] == {'num_matched_lines': 1, 'num_matched_words': 2}
+    assert 'master' in matrix['nested_dir_1/more_biased_words.txt']
+    rollup = aggregator.directory_rollup(1)
+    assert set(rollup) == {'.', 'nested_dir_1'}
+    assert rollup['nested_dir_1']['num_matched_files'] == 2
+    assert rollup['.']['terms']['whitelist'] == 1
+    assert 'nested_dir_1/nested_dir_2' in aggregator.directory_rollup(2)
+
+
+def test_parse_shard():
+    assert parse_shard('2/4') == (2, 4)
+    for invalid in ['0/4', '5/4', '1/0', '1', 'a/b']:
+        with pytest.raises(Exception):
+            parse_shard(invalid)
+
+
+def test_sharded_rg_search():
+    process_and_return_exclusions(
+        mock_repo_path, constants.EXCLUDE_FILE, constants.RGIGNORE_FILE)
+    shards = [list_shard_files(mock_repo_path, i, 3) for i in range(1, 4)]
+    all_files = [file for shard in shards for file in shard]
+    assert len(all_files) == len(set(all_files)) == 5
+    assert list_shard_files(mock_repo_path, 2, 3) == shards[1]
+
+    matches = 0
+    for shard in shards:
+        summary = json.loads(rg_search('whitelist', mock_repo_path, shard)[-1])
+        matches += summary['data']['stats']['matches']
+    assert matches == 5
+
+
+def test_shard_skips_binary_files(tmp_path):
+    (tmp_path / 'a.txt').write_text('master\n')
+    (tmp_path / 'b.bin').write_bytes(b'master line\n\0binary master')
+    path = str(tmp_path)
+    files = list_shard_files(path, 1, 1)
+    assert files == [f'{path}/a.txt']
+    # rg searches the binary files it is given by name
+    summary = json.loads(rg_search('master', path, files)[-1])
+    single = json.loads(rg_search('master', path)[-1])
+    assert summary['data']['stats']['matched_lines'] == single['data']['stats']['matched_lines'] == 1
+
+
+def test_merge_summaries():
+    word = {'biased_word': 'master', 'num_matched_lines': 1,
+            'num_matched_words': 2, 'num_matched_files': 1}
+    shard_1 = {'biased_words': ['master', 'slave'],
+               'master': dict(word, files=['c.txt']), 'slave': {},
+               'terms_found': True, 'total_lines_matched': 1,
+               'total_words_matched': 2, 'total_files_matched': 1, 'shard': '1/2'}
+    shard_2 = {'biased_words': ['master', 'slave'],
+               'master': dict(word, files=['b.txt']), 'slave': {},
+               'terms_found': True, 'total_lines_matched': 1,
+               'total_words_matched': 2, 'total_files_matched': 1, 'shard': '2/2'}
+    merged = merge_summaries([shard_1, shard_2])
+    assert merged['master']['num_matched_words'] == 4
+    assert merged['master']['files'] == ['b.txt', 'c.txt']
+    assert merged['slave'] == {}
+    assert merged['total_files_matched'] == 2
+    assert 'shard' not in merged
+    merged = merge_summaries([dict(shard_1, total_lines_consolidated=1),
+                              dict(shard_2, total_lines_consolidated=1)])
+    assert merged['total_lines_consolidated'] == 2
+    with pytest.raises(Exception) as missing:
+        merge_summaries([shard_1, shard_1])
+    assert 'exactly once' in str(missing.value)
+    with pytest.raises(Exception) as conflicting:
+        merge_summaries([shard_1, shard_2, dict(shard_1, shard='1/3')])
+    assert '1/3' in str(conflicting.value)
+
+    def occurrence(path, line):
+        return {'description': 'Biased term found: master',
+                'location': {'path': path, 'lines': {'begin': line}}}
+    merged = merge_codeclimate([[occurrence('c.txt', 1)],
+                                [occurrence('b.txt', 9), occurrence('b.txt', 2)]])
+    assert [(o['location']['path'], o['location']['lines']['begin']) for o in merged] == \
+        [('b.txt', 2), ('b.txt', 9), ('c.txt', 1)]
+
+
 def test_process_biased_word_line(batch_info):
     line = ['blacklist', 'blocklist']
     logger = BiasedLanguageLogger(name='test_logger', filename=None)
@@ -157,6 +287,439 @@ def test_process_biased_word_line(batch_info):
     assert 'blacklist' in occurrences['biased_words']
 
 
+def test_scan():
+    result = scan([mock_repo_path], ['master', 'whitelist', 'nonexistent'])
+    first = next(result)
+    assert isinstance(first, Occurrence)
+    assert first.root == mock_repo_path
+    occurrences = [first] + list(result)
+    assert len(occurrences) == 7
+    assert not any(o.path.startswith('nested_dir_1/nested_dir_2/excluded_dir')
+                   for o in occurrences)
+    summary = result.summary
+    assert summary['biased_words'] == ['master', 'whitelist', 'nonexistent']
+    assert summary['whitelist']['num_matched_words'] == 5
+    assert summary['whitelist']['num_matched_files'] == 3
+    assert summary['nonexistent'] == {}
+    assert summary['total_lines_matched'] == 7
+    assert summary['total_files_matched'] == 3
+    assert summary['terms_found'] == True
+
+    # same fingerprints and report entries as the CLI
+    rg_results = rg_search('whitelist', mock_repo_path)
+    _, word_report, _ = process_word_occurrences(
+        rg_results, {}, 'whitelist', mock_repo_path, False)
+    assert sorted(r['fingerprint'] for r in word_report) == sorted(
+        o.fingerprint for o in occurrences if o.biased_word == 'whitelist')
+    assert occurrences[-1].to_codeclimate() in word_report
+
+
+def test_scan_matches_cli(tmp_path):
+    # the library searches with the CLI's exclusions, nested ones included
+    files = {
+        '.biased_lang_exclude': 'gen/\n',
+        'a.txt': 'master\n',
+        'gen/b.txt': 'master\n',
+        'docs/.biased_lang_exclude': 'old.md\n',
+        'docs/old.md': 'master\n',
+        'docs/new.md': 'master\n' * 10,
+    }
+    for name, content in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(content)
+    result = scan(str(tmp_path), ['master'])
+    paths = sorted({occurrence.path for occurrence in result})
+    assert paths == ['a.txt', 'docs/new.md']
+    assert result.summary['master']['num_matched_lines'] == 11
+
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': str(tmp_path), 'url': None, 'splunk_flag': False, 'err_file': None,
+            'github_repo': None}
+    main(args, logger)
+    with open(constants.CODECLIMATE_FILENAME) as report:
+        assert sorted({occurrence['location']['path']
+                       for occurrence in json.load(report)}) == paths
+
+    # and skips the files above max_file_size like --max_file_size
+    result = scan(str(tmp_path), ['master'], {'max_file_size': '20'})
+    assert sorted(occurrence.path for occurrence in result) == ['a.txt']
+
+
+def test_scan_terms_are_patterns(tmp_path):
+    # terms never reach a shell nor rg's flags
+    (tmp_path / 'a.txt').write_text('-v\nthe master list\n')
+    marker = tmp_path / 'marker'
+    result = scan(str(tmp_path), [f'x; touch {marker}', '-v', 'master list'])
+    assert sorted(o.biased_word for o in result) == ['-v', 'master list']
+    assert not marker.exists()
+
+    # a failed search isn't reported as a clean one
+    with pytest.raises(Exception, match='regex parse error'):
+        list(scan(str(tmp_path), ['ma(ster']))
+
+
+def test_scan_summary_without_iterating():
+    summary = scan(mock_repo_path, ['blacklist']).summary
+    assert summary['total_lines_matched'] == 4
+    assert summary['total_words_matched'] == 5
+
+
+def test_max_matches_per_term(batch_info):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    code_quality_report, splunk_events = [], []
+    args = {'path': mock_repo_path, 'splunk_flag': False}
+    terms_found, occurrences = process_biased_word_line(
+        ['whitelist'], {'biased_words': []}, code_quality_report, splunk_events,
+        args, batch_info, False, logger, None, 2)
+    assert terms_found == True
+    assert len(code_quality_report) == 2
+    assert occurrences['whitelist']['max_matches_reached'] == True
+    assert occurrences['whitelist']['num_matched_lines'] == 2
+    # only the files of the collected occurrences are listed
+    assert sorted(os.path.relpath(file, mock_repo_path)
+                  for file in occurrences['whitelist']['files']) == sorted(
+        {occurrence['location']['path'] for occurrence in code_quality_report})
+
+    # a cap that isn't exceeded leaves rg's totals alone
+    code_quality_report = []
+    _, occurrences = process_biased_word_line(
+        ['whitelist'], {'biased_words': []}, code_quality_report, splunk_events,
+        args, batch_info, False, logger, None, 4)
+    assert 'max_matches_reached' not in occurrences['whitelist']
+    assert occurrences['whitelist']['num_matched_words'] == 5
+
+
+def test_baseline(batch_info, tmp_path):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': mock_repo_path, 'splunk_flag': False}
+    code_quality_report = []
+    process_biased_word_line(['whitelist'], {'biased_words': []}, code_quality_report,
+                             [], args, batch_info, False, logger)
+    baseline_file = tmp_path / 'baseline.txt'
+    write_baseline(baseline_file, [occurrence['fingerprint']
+                                   for occurrence in code_quality_report[:3]])
+    baseline = load_baseline(baseline_file)
+    assert sorted(baseline) == baseline_file.read_text().split()
+
+    args['baseline_fingerprints'] = baseline
+    new_report = []
+    terms_found, occurrences = process_biased_word_line(
+        ['whitelist'], {'biased_words': []}, new_report, [], args, batch_info, False, logger)
+    assert terms_found == True
+    assert new_report == code_quality_report[3:]
+    assert occurrences['whitelist']['num_matched_lines'] == 1
+    assert occurrences['whitelist']['num_suppressed_lines'] == 3
+    assert occurrences['whitelist']['num_matched_files'] == 1
+    assert occurrences['total_lines_suppressed'] == 3
+
+    # a term whose occurrences are all known is not found
+    args['baseline_fingerprints'] = baseline | {code_quality_report[3]['fingerprint']}
+    terms_found, occurrences = process_biased_word_line(
+        ['whitelist'], {'biased_words': []}, [], [], args, batch_info, False, logger)
+    assert terms_found == False
+    assert occurrences['whitelist'] == {}
+    assert occurrences['total_lines_suppressed'] == 4
+    assert find_first_match([['whitelist']], mock_repo_path,
+                            baseline=args['baseline_fingerprints']) is None
+
+    with pytest.raises(Exception):
+        load_baseline(tmp_path / 'missing.txt')
+
+
+def test_consolidate(batch_info):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': mock_repo_path, 'splunk_flag': True}
+    terms = [['master'], ['slave'], ['whitelist'], ['blacklist']]
+    summary, consolidated_summary = {'biased_words': []}, {'biased_words': []}
+    code_quality_report, matches = [], []
+    consolidator = LineConsolidator(max_line_len=20)
+    for line in terms:
+        _, summary = process_biased_word_line(
+            line, summary, code_quality_report, [], args, batch_info, False, logger)
+        _, consolidated_summary = process_biased_word_line(
+            line, consolidated_summary, matches, [], args, batch_info, False, logger,
+            consolidator=consolidator)
+    # the per term counts don't change
+    assert consolidated_summary == summary
+    assert len(matches) == len(code_quality_report) == 14
+
+    report, events = consolidator.report(batch_info, splunk_flag=True)
+    assert len(report) == len(events) == 11
+    record, event = report[0], events[0]
+    assert record['location']['path'] == 'nested_dir_1/more_biased_words.txt'
+    assert record['biased_words'] == ['master', 'slave', 'whitelist', 'blacklist']
+    assert record['description'] == 'Biased terms found: master, slave, whitelist, blacklist'
+    assert [match['biased_word'] for match in record['matches']] == [
+        'whitelist', 'blacklist', 'slave', 'master']
+    # one truncation with the matches of every term
+    assert event['line_truncated'] == True
+    assert event['line'].count('...\n...') == 3
+    # a line with a single term keeps its per term fingerprint
+    single = [occurrence for occurrence in report if len(occurrence['biased_words']) == 1]
+    assert single[0]['description'] == 'Biased term found: master'
+    assert single[0]['fingerprint'] in {occurrence['fingerprint'] for occurrence in code_quality_report}
+
+
+def test_scan_archives(batch_info, tmp_path):
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    (repo / 'plain.txt').write_text('master\n')
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as jar:
+        jar.writestr('config.yml', 'replica: slave\n')
+        jar.writestr('deeper.zip', b'')
+    with zipfile.ZipFile(repo / 'bundle.whl', 'w') as wheel:
+        wheel.writestr('pkg/README', 'intro\nthe Master and the master\n')
+        wheel.writestr('pkg/lib.so', b'\0master')
+        wheel.writestr('pkg/huge.txt', 'master ' * 100)
+        wheel.writestr('pkg/lib.jar', inner.getvalue())
+    with tarfile.open(repo / 'vendor.tar.gz', 'w:gz') as tar:
+        data = 'master\n'.encode()
+        info = tarfile.TarInfo('vendor/notes.txt')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    path = str(repo)
+    archives = sorted(find_archives(path))
+    assert archives == [f'{path}/bundle.whl', f'{path}/vendor.tar.gz']
+    scanner = ArchiveScanner(['master', 'slave'], max_member_size=500, max_depth=2)
+    scanner.scan(archives)
+    # too big, and nested deeper than the depth limit
+    assert scanner.skipped == [f'{path}/bundle.whl!pkg/huge.txt',
+                               f'{path}/bundle.whl!pkg/lib.jar!deeper.zip']
+
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': path, 'splunk_flag': False, 'scan_archives': True}
+    summary, report = {'biased_words': []}, []
+    for word in ['master', 'slave']:
+        _, summary = process_biased_word_line(
+            [word], summary, report, [], args, batch_info, False, logger,
+            archive_scanner=scanner)
+    assert summary['master']['num_matched_lines'] == 3
+    assert summary['master']['num_matched_words'] == 4
+    assert summary['master']['num_matched_files'] == 3
+    paths = {(occurrence['location']['path'], occurrence['location']['lines']['begin'])
+             for occurrence in report}
+    assert paths == {('plain.txt', 1), ('bundle.whl!pkg/README', 2),
+                     ('vendor.tar.gz!vendor/notes.txt', 1),
+                     ('bundle.whl!pkg/lib.jar!config.yml', 1)}
+
+
+def test_scan_archives_with_file_list(tmp_path):
+    # rg searches an uncompressed tar given by name, its members must only
+    # be counted once
+    with tarfile.open(tmp_path / 'v.tar', 'w') as tar:
+        data = 'master\n'.encode()
+        info = tarfile.TarInfo('m.txt')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    for shard in [None, '1/1']:
+        args = {'path': str(tmp_path), 'url': None, 'splunk_flag': False, 'err_file': None,
+                'github_repo': None, 'scan_archives': True, 'shard': shard}
+        main(args, logger)
+        with open(constants.CODECLIMATE_FILENAME) as report:
+            assert [occurrence['location']['path'] for occurrence in json.load(report)] == \
+                ['v.tar!m.txt']
+
+    # the gate sees the archive members too
+    args = dict(args, fail_fast=True, shard=None)
+    with pytest.raises(SystemExit) as exit:
+        main(args, logger)
+    assert exit.value.code == 1
+
+
+def test_trigram_index(batch_info, tmp_path):
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    (repo / 'a.txt').write_text('The MASTER branch\n')
+    (repo / 'b.txt').write_text('main branch\n')
+    (repo / 'c.bin').write_bytes(b'\0master')
+    path = str(repo)
+    index = TrigramIndex(str(tmp_path / 'trigrams.db'), path)
+    assert index.update(Walker(path)) == 3
+    assert index.update(Walker(path)) == 0
+    assert index.candidates('master') == [f'{path}/a.txt']
+    assert index.candidates('mas.er') == None
+
+    (repo / 'b.txt').write_text('main and master branch, longer\n')
+    (repo / 'a.txt').unlink()
+    assert index.update(Walker(path)) == 1
+    assert index.candidates('master') == [f'{path}/b.txt']
+    assert index.candidates('slave') == []
+    index.close()
+
+    # rg -i matches 'ſ' for s and the Kelvin sign for k
+    (repo / 'folded.txt').write_text('the ma\u017fter and the blac\u212alist\n')
+    (repo / 'utf16.txt').write_text('\ufeffmaster\n', encoding='utf-16-le')
+    index = TrigramIndex(str(tmp_path / 'folded.db'), path)
+    assert index.update(Walker(path)) == 4
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': path, 'splunk_flag': False}
+    for word in ['master', 'blacklist']:
+        report, indexed_report = [], []
+        process_biased_word_line([word], {'biased_words': []}, report, [], args,
+                                 batch_info, False, logger)
+        process_biased_word_line([word], {'biased_words': []}, indexed_report, [], args,
+                                 batch_info, False, logger, trigram_index=index)
+        assert report
+        assert sorted(o['fingerprint'] for o in indexed_report) == \
+            sorted(o['fingerprint'] for o in report)
+    index.close()
+
+    # the budget stops the update, the limit keeps files from being read
+    index = TrigramIndex(str(tmp_path / 'limits.db'), path)
+    assert index.update(Walker(path), out_of_time=lambda: True) == None
+    assert index.update(Walker(path), max_file_size='10') == 4
+    assert index.candidates('master') == sorted(
+        file for file, stat in Walker(path) if stat.st_size > 10)
+    index.close()
+
+    # same results as searching the whole repo
+    index = TrigramIndex(str(tmp_path / 'mock_repo.db'), mock_repo_path)
+    index.update(Walker(mock_repo_path))
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': mock_repo_path, 'splunk_flag': False}
+    for word in ['master', 'slave', 'nonexistent']:
+        report, indexed_report = [], []
+        _, summary = process_biased_word_line(
+            [word], {'biased_words': []}, report, [], args, batch_info, False, logger)
+        _, indexed_summary = process_biased_word_line(
+            [word], {'biased_words': []}, indexed_report, [], args, batch_info, False, logger,
+            trigram_index=index)
+        assert sorted(indexed_summary[word].get('files', [])) == sorted(summary[word].get('files', []))
+        assert indexed_summary[word].get('num_matched_words') == summary[word].get('num_matched_words')
+        assert sorted(o['fingerprint'] for o in indexed_report) == sorted(o['fingerprint'] for o in report)
+    index.close()
+
+
+def test_get_max_matches():
+    assert get_max_matches({}, 10) == None
+    assert get_max_matches({'max_matches_per_term': 5}, 10) == 5
+    assert get_max_matches({'max_matches': 12}, 10) == 2
+    assert get_max_matches({'max_matches': 12, 'max_matches_per_term': 1}, 10) == 1
+    assert get_max_matches({'max_matches': 5}, 10) == 0
+
+
+def test_max_matches():
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': mock_repo_path, 'url': None, 'splunk_flag': False, 'err_file': None,
+            'github_repo': None, 'max_matches': 2}
+    main(args, logger)
+    with open(constants.SUMMARY_FILENAME) as summary_file:
+        summary = json.load(summary_file)
+    assert summary['max_matches_reached'] == True
+    assert summary['total_lines_matched'] == 2
+    assert summary['total_files_matched'] == 2
+    # the terms after the cap are never searched
+    assert summary['terms_not_searched'] == ['blacklist', 'whitelist', 'slave']
+    assert summary['biased_words'] == ['master', 'blacklist', 'whitelist', 'slave']
+    assert summary['slave'] == {}
+
+    # merged with a full shard, the other terms' counts are kept
+    main(dict(args, max_matches=None, shard='2/2'), logger)
+    with open(constants.SUMMARY_FILENAME) as summary_file:
+        full = json.load(summary_file)
+    merged = merge_summaries([dict(summary, shard='1/2'), full])
+    assert merged['biased_words'] == full['biased_words']
+    assert merged['max_matches_reached'] == True
+    assert merged['terms_not_searched'] == ['blacklist', 'whitelist', 'slave']
+    for word in full['biased_words']:
+        if full[word]:
+            assert merged[word]['num_matched_lines'] >= full[word]['num_matched_lines']
+
+
+def test_fail_fast():
+    match = find_first_match([['nonexistent'], ['slave']], mock_repo_path)
+    assert match.biased_word == 'slave'
+    assert find_first_match([['nonexistent']], mock_repo_path) == None
+
+    args = {'path': mock_repo_path, 'url': None, 'splunk_flag': False,
+            'err_file': constants.ERR_FILE, 'github_repo': None, 'fail_fast': True}
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    with pytest.raises(SystemExit) as exit:
+        main(args, logger)
+    assert exit.value.code == 1
+    assert os.path.exists(constants.ERR_FILE)
+
+
+def test_resource_governor(batch_info):
+    clock = FakeClock()
+    governor = ResourceGovernor(time_budget=60, term_timeout=20, clock=clock)
+    governor.start_search()
+    assert governor.search_timeout() == 20
+    clock.now = 50
+    governor.start_search()
+    # the end of the budget comes before the term timeout
+    assert governor.search_timeout() == 10
+    assert governor.exhausted() == False
+    clock.now = 60
+    assert governor.out_of_time() == True
+    assert governor.limits_hit == []
+    assert governor.exhausted() == True
+    assert governor.limits_hit == ['time_budget']
+
+    # a term timeout kills the search but doesn't stop the run
+    governor = ResourceGovernor(term_timeout=0.05)
+    governor.start_search()
+    assert list(stream_output(['sleep', '5'], governor)) == [KILLED]
+    assert governor.limits_hit == ['term_timeout']
+    assert governor.exhausted() == False
+
+    governor = ResourceGovernor(max_rss=512, max_rss_func=lambda: 1024)
+    json_results, word_report, _ = process_word_occurrences(
+        rg_search('whitelist', mock_repo_path), batch_info, 'whitelist',
+        mock_repo_path, False, governor=governor)
+    assert json_results['incomplete'] == True
+    assert json_results['num_matched_lines'] == 0
+    assert word_report == []
+    assert governor.limits_hit == ['max_rss']
+
+
+def test_term_timeout_with_file_list(batch_info, tmp_path):
+    # rg blocks on a fifo named explicitly until the timeout kills it, the
+    # totals combined afterwards must not hide that
+    fifo = str(tmp_path / 'fifo')
+    os.mkfifo(fifo)
+    files = [os.path.join(mock_repo_path, 'biased_words.txt'), fifo]
+    for archive_scanner in [None, ArchiveScanner(['whitelist'])]:
+        governor = ResourceGovernor(term_timeout=0.5)
+        results = rg_search_iter('whitelist', mock_repo_path, files, '', governor)
+        if archive_scanner is not None:
+            results = archive_scanner.results('whitelist', results)
+        json_results, word_report, _ = process_word_occurrences(
+            results, batch_info, 'whitelist', mock_repo_path, False, governor=governor)
+        assert json_results['incomplete'] == True
+        assert json_results['num_matched_lines'] == len(word_report)
+        assert governor.limits_hit == ['term_timeout']
+
+
+def test_term_timeout_is_not_a_clean_run():
+    if os.path.exists(constants.ERR_FILE):
+        os.remove(constants.ERR_FILE)
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    args = {'path': mock_repo_path, 'url': None, 'splunk_flag': False,
+            'err_file': constants.ERR_FILE, 'github_repo': None, 'term_timeout': 1e-6}
+    main(args, logger)
+    with open(constants.SUMMARY_FILENAME) as summary_file:
+        summary = json.load(summary_file)
+    assert summary['incomplete'] == True
+    # the terms killed before their first match are still reported
+    for word in summary['biased_words']:
+        assert summary[word]['incomplete'] == True
+    assert os.path.exists(constants.ERR_FILE)
+
+
+def test_max_file_size():
+    rg_options = get_rg_options({'max_file_size': '10'})
+    assert rg_search('master', mock_repo_path) != rg_search('master', mock_repo_path, None, rg_options)
+    summary = json.loads(rg_search('master', mock_repo_path, None, rg_options)[-1])
+    assert summary['data']['stats']['matches'] == 0
+    # rg searches the files it is given by name whatever their size
+    assert list_shard_files(mock_repo_path, 1, 1, max_file_size='10') == []
+    assert parse_file_size('2K') == 2048
+
+
 def test_exclusions():
     biased_word = 'master'
     process_and_return_exclusions(
@@ -196,6 +759,293 @@ def test_event2splunk(mocker):
     event2splunk._send_batch.assert_called()
 
 
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) == None
+    assert parse_retry_after('30') == 30.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=1445412500.0) == 10.0
+    assert parse_retry_after('soon') == None
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock)
+    assert bucket.take(100) == 0.0
+    assert bucket.take(50) == 0.5
+    clock.sleep(0.5)
+    assert bucket.take(50) == 0.0
+    # batches bigger than the bucket go through once it's full
+    clock.sleep(1)
+    assert bucket.take(250) == 0.0
+    assert bucket.take(1) > 1
+
+
+def test_flow_controller_aimd():
+    clock = FakeClock()
+    flow = FlowController(rate=1000, window=4, max_window=8,
+                          clock=clock, sleep=clock.sleep)
+    flow.record(True, 200)
+    assert flow.window == 4
+    assert flow.rate == 1100
+    flow.record(False, 503, retry_after=5)
+    assert flow.window == 2
+    assert flow.rate == 550
+    # new requests wait out the Retry-After pause
+    flow.acquire(1)
+    assert clock.now >= 5
+    assert flow.in_flight == 1
+    flow.release()
+    # errors that aren't backpressure leave the window alone
+    flow.record(False, 400)
+    assert flow.window == 2
+
+
+def test_hec_client_honours_retry_after(mocker):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    flow = FlowController(rate=1000)
+    client = SplunkHECClient('https', 'fakeurl.com', '1234', 'Splunk token', logger, flow=flow)
+    mocker.patch.object(client, '_post', side_effect=[
+        (False, 'busy', 503, 7.0, None), (True, None, 200, None, '{}')])
+    sleep = mocker.patch('tools.splunkhecclient.time.sleep')
+    assert client.post('{}') == True
+    sleep.assert_called_once_with(7.0)
+
+
+def test_event2splunk_indexer_ack():
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    with StubHEC(ack=True) as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(), logger)
+        event2splunk._batch_size = 2
+        for i in range(5):
+            event2splunk.post_event(payload={'i': i}, source='testing', sourcetype='testing')
+        event2splunk.close()
+        assert event2splunk.ingested_events == 5
+        assert sorted(event['event']['i'] for event in stub.events) == list(range(5))
+        # every batch goes out on the same channel, acks are polled in bulk
+        assert len(stub.requests) == 3
+        assert len(set(stub.requests)) == 1 and stub.requests[0] is not None
+        assert stub.ack_queries[0][0] == stub.requests[0]
+        assert len(stub.ack_queries) < len(stub.requests)
+
+
+def test_event2splunk_resends_unacknowledged_batches():
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    with StubHEC(ack=True, lost_acks=[0]) as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(
+            hec_ack_timeout=0, hec_ack_poll_interval=0), logger)
+        event2splunk.post_event(payload={}, source='testing', sourcetype='testing')
+        event2splunk.close()
+        assert event2splunk.ingested_events == 1
+        assert len(stub.events) == 2
+
+
+def test_event2splunk_retries_busy_hec():
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    with StubHEC(busy_responses=1, retry_after=0) as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(), logger)
+        event2splunk.post_event(payload={}, source='testing', sourcetype='testing')
+        event2splunk.close()
+        assert event2splunk.ingested_events == 1
+        assert len(stub.requests) == 2
+
+
+def test_build_rollups(batch_info):
+    aggregator = MatchAggregator(mock_repo_path)
+    for biased_word in ['whitelist', 'master']:
+        process_word_occurrences(rg_search(biased_word, mock_repo_path),
+                                 batch_info, biased_word, mock_repo_path, False, aggregator)
+    rollups = build_rollups(aggregator)
+    terms = {dims['biased_word']: counts for dims, counts in rollups
+             if dims['rollup'] == 'term'}
+    assert terms['whitelist'] == {'num_matched_files': 3,
+                                  'num_matched_lines': 4, 'num_matched_words': 5}
+    files = [dims for dims, _ in rollups if dims['rollup'] == 'file']
+    assert len(files) == 6
+    directories = {dims['directory']: counts for dims, counts in rollups
+                   if dims['rollup'] == 'directory'}
+    assert directories['nested_dir_1']['num_matched_files'] == 2
+
+
+def test_sample_events():
+    events = [{'fingerprint': '%032x' % (i * 0x01000000 << 96)} for i in range(256)]
+    sampled = sample_events(events, 0.25)
+    assert 60 < len(sampled) < 70
+    assert sample_events(events, 0.25) == sampled
+    assert sample_events(events, 0) == []
+    assert sample_events(events, 1) == events
+
+
+def test_send_rollup_batch(batch_info):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    rollups = [({'rollup': 'term', 'biased_word': 'master'},
+                {'num_matched_lines': 3, 'num_matched_words': 4})]
+    with StubHEC() as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(), logger)
+        send_rollup_batch(rollups, batch_info, 'repo', 'testing', event2splunk)
+        send_rollup_batch(rollups, batch_info, 'repo', 'testing', event2splunk,
+                          metrics_index='bias_language_metrics')
+        send_rollup_batch(rollups, batch_info, 'repo', 'testing', event2splunk)
+    event, metric, last = stub.events
+    assert event['event']['num_matched_lines'] == 3
+    assert event['event']['content'] == constants.ROLLUP_CONTENT
+    assert metric['event'] == 'metric'
+    assert metric['index'] == 'bias_language_metrics'
+    assert metric['fields']['metric_name:biased_lang.num_matched_words'] == 4
+    assert metric['fields']['biased_word'] == 'master'
+    # the metrics index doesn't stick to later events
+    assert last['index'] == 'bias_language'
+
+
+def test_encode_splunk_events(batch_info, tmp_path):
+    _, code_quality_report, events = process_word_occurrences(
+        rg_search('master', mock_repo_path), batch_info, 'master', mock_repo_path, True)
+    encoded_report = encode_occurrences(code_quality_report)
+    encoded_events = encode_splunk_events(events, encoded_report, batch_info)
+    # splicing gives the same bytes as encoding the merged event dicts
+    assert encoded_events == [json.dumps(event) for event in events]
+
+    codeclimate_file = tmp_path / 'codeclimate.json'
+    write_encoded_list(codeclimate_file, encoded_report)
+    assert json.loads(codeclimate_file.read_text()) == code_quality_report
+    write_encoded_list(codeclimate_file, [])
+    assert json.loads(codeclimate_file.read_text()) == []
+
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    with StubHEC() as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(), logger)
+        send_encoded_batch(constants.CODECLIMATE_FILENAME, encoded_events,
+                           'repo', 'testing', event2splunk)
+    assert [event['event'] for event in stub.events] == events
+    assert len({event['time'] for event in stub.events}) == 1
+    assert stub.events[0]['source'] == 'repo'
+
+
+def test_report_pipeline(batch_info, tmp_path):
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    codeclimate_file = tmp_path / 'codeclimate.json'
+    report, events = [], []
+    with StubHEC() as stub:
+        event2splunk = Event2Splunk(stub.splunk_env(), logger)
+        pipeline = ReportPipeline(codeclimate_file, batch_info, sinks=[event2splunk],
+                                  repo_name='repo', source_type='testing', maxsize=1)
+        for word in ['master', 'slave', 'nonexistent']:
+            _, word_report, word_events = process_word_occurrences(
+                rg_search(word, mock_repo_path), batch_info, word, mock_repo_path, True)
+            pipeline.put(word_report, word_events)
+            report += word_report
+            events += word_events
+        encoded_report, encoded_events = pipeline.finish()
+    assert json.loads(codeclimate_file.read_text()) == report
+    assert encoded_report == encode_occurrences(report)
+    assert [event['event'] for event in stub.events] == events
+    assert encoded_events == [json.dumps(event) for event in events]
+
+    # a failing worker doesn't block the scan, the error comes out of finish()
+    pipeline = ReportPipeline(codeclimate_file, batch_info, encode_events=True, maxsize=1)
+    for _ in range(3):
+        pipeline.put(report, [{}] * len(report))
+    with pytest.raises(KeyError):
+        pipeline.finish()
+
+
+def test_delta_state(batch_info, tmp_path):
+    _, report, events = process_word_occurrences(
+        rg_search('master', mock_repo_path), batch_info, 'master', mock_repo_path, True)
+    encoded_events = encode_splunk_events(events, encode_occurrences(report), batch_info)
+    state = DeltaState(str(tmp_path / 'state'), 'splunk/biased-lang')
+    changes, counts = state.diff(report, encoded_events, batch_info)
+    assert counts == {'added': len(report), 'resolved': 0}
+    assert [json.loads(encoded) for _, encoded in changes] == [
+        dict(event, delta='added') for event in events]
+    state.save(report, batch_info)
+    assert state.path.endswith('splunk__biased-lang.json')
+
+    # next run: the first occurrence is gone, a new one showed up
+    new_occurrence = dict(report[0], fingerprint='0' * 32)
+    state = DeltaState(str(tmp_path / 'state'), 'splunk/biased-lang')
+    changes, counts = state.diff([new_occurrence] + report[1:],
+                                 ['{"fingerprint": "%s"}' % ('0' * 32)] + encoded_events[1:],
+                                 batch_info)
+    assert counts == {'added': 1, 'resolved': 1}
+    added, resolved = [json.loads(encoded) for _, encoded in changes]
+    assert added == {'delta': 'added', 'fingerprint': '0' * 32}
+    assert resolved['delta'] == 'resolved'
+    assert resolved['fingerprint'] == report[0]['fingerprint']
+    assert resolved['location'] == report[0]['location']
+    assert resolved['uuid'] == batch_info['uuid']
+
+
+def test_occurrence_db(tmp_path):
+    db_path = str(tmp_path / 'biased-lang.db')
+    db = OccurrenceDB(db_path)
+    logger = BiasedLanguageLogger(name='test_logger', filename=None)
+    report = []
+    summary = {'biased_words': []}
+    for word in ['master', 'whitelist']:
+        _, summary = process_biased_word_line(
+            [word], summary, report, [], {'path': mock_repo_path, 'splunk_flag': False},
+            {}, False, logger)
+    summary.update(terms_found=True, total_lines_matched=len(report),
+                   total_words_matched=0, total_files_matched=3)
+    first, second = get_batch_info(), get_batch_info()
+    db.record_run('splunk/biased-lang', first, summary, report)
+    db.record_run('splunk/biased-lang', second, summary, report[1:])
+
+    terms = {row['term']: row for row in db.term_counts()}
+    assert terms['whitelist']['num_matched_lines'] == 4
+    assert terms['master']['num_matched_lines'] == len(report) - 5
+    paths = db.path_counts(term='whitelist')
+    assert sum(row['num_matched_lines'] for row in paths) == 4
+    assert [row['num_matched_lines'] for row in db.trend()] == [len(report), len(report) - 1]
+
+    # the delta state is the last delivered run
+    state = DBDeltaState(db, 'splunk/biased-lang')
+    assert state.load() == {}
+    state.save(report, first)
+    state = DBDeltaState(db, 'splunk/biased-lang')
+    assert state.load() == {occurrence['fingerprint']: occurrence for occurrence in report}
+    changes, counts = state.diff(report[1:], [json.dumps(o) for o in report[1:]], first)
+    assert counts == {'added': 0, 'resolved': 1}
+
+    # consolidated records keep their fingerprint, with a row per term
+    consolidator = LineConsolidator()
+    summary = {'biased_words': []}
+    for word in ['master', 'whitelist']:
+        _, summary = process_biased_word_line(
+            [word], summary, [], [], {'path': mock_repo_path, 'splunk_flag': False},
+            {}, False, logger, consolidator=consolidator)
+    consolidated, _ = consolidator.report({})
+    third = get_batch_info()
+    db.record_run('splunk/biased-lang', third, dict(summary, terms_found=True,
+                  total_lines_matched=len(report), total_words_matched=0,
+                  total_files_matched=3), consolidated)
+    terms = {row['term']: row for row in db.term_counts()}
+    assert terms['whitelist']['num_matched_lines'] == 4
+    assert terms['master']['num_matched_lines'] == len(report) - 4
+    state.save(consolidated, third)
+    state = DBDeltaState(db, 'splunk/biased-lang')
+    loaded = state.load()
+    assert sorted(loaded) == sorted(record['fingerprint'] for record in consolidated)
+    assert sorted(occurrence['description'] for occurrence in loaded.values()) == \
+        sorted(record['description'] for record in consolidated)
+    _, counts = state.diff(consolidated, [json.dumps(o) for o in consolidated], third)
+    assert counts == {'added': 0, 'resolved': 0}
+    db.close()
+
+    assert query({'query': 'trend', 'db': db_path, 'repo': 'splunk/biased-lang',
+                  'term': 'whitelist'})[-1]['num_matched_lines'] == 4
+
+
 def test_is_json():
     valid_json = '{"type":"begin","data":{"path":{"text":"./tests/mock_repo/nested_dir_1/more_biased_words.txt"}}}'
     invalid_json = '{["Error": "True"], "{"type":"begin","data":{"path":{"text":"./tests/mock_repo/nested_dir_1/more_biased_words.txt"}}}}'
@@ -204,8 +1054,59 @@ def test_is_json():
 
 
 def test_add_lines():
+    # the repo's .biased_lang_exclude applies even without exclusions
     line_count = add_lines(mock_repo_path, [])
-    assert line_count == 22
+    assert line_count == 18
+
+
+def test_walker(tmp_path):
+    repo = tmp_path / 'repo'
+    files = {
+        '.git/HEAD': 'ref\n',
+        '.gitignore': '*.log\nbuild/\n/top.txt\n',
+        '.rgignore': '.git\n*.tmp\n',
+        '.hidden.txt': 'a\n',
+        'top.txt': 'a\n',
+        'keep.log': 'a\n',
+        'build/out.txt': 'a\n',
+        'src/top.txt': 'a\n',
+        'src/.gitignore': '!keep.log\n!keep.tmp\ngen/**/*.txt\n',
+        'src/keep.log': 'a\n',
+        # an .rgignore at any level wins over a .gitignore
+        'src/keep.tmp': 'a\n',
+        'src/gen/a/b.txt': 'a\n',
+        'src/gen/a/b.md': 'a\n',
+        'docs/.biased_lang_exclude': 'old_*\n',
+        'docs/old_terms.md': 'a\n',
+        'docs/new_terms.md': 'a\n',
+    }
+    for name, content in files.items():
+        (repo / name).parent.mkdir(parents=True, exist_ok=True)
+        (repo / name).write_text(content)
+    os.symlink(repo / 'src', repo / 'link')
+    path = str(repo)
+
+    walker = Walker(path)
+    entries = list(walker)
+    walked = sorted(file[len(path)+1:] for file, _ in entries)
+    assert walked == ['.gitignore', '.hidden.txt', '.rgignore',
+                      'docs/.biased_lang_exclude', 'docs/new_terms.md',
+                      'src/.gitignore', 'src/gen/a/b.md', 'src/keep.log',
+                      'src/top.txt']
+    assert all(stat.st_size == os.stat(file).st_size for file, stat in entries)
+    assert walker.nested_excludes == True
+    assert has_nested_excludes(path) == True
+    assert has_nested_excludes(mock_repo_path) == False
+    # rg agrees, apart from the exclude file it can't read
+    rg_files = subprocess.run(['rg', '--files', '--hidden', path], capture_output=True,
+                              text=True).stdout.splitlines()
+    assert sorted(file[len(path)+1:] for file in rg_files) == sorted(walked + ['docs/old_terms.md'])
+
+    followed = sorted(file[len(path)+1:] for file, _ in Walker(path, follow_symlinks=True))
+    assert 'link/keep.log' in followed
+    visible = [file for file, _ in Walker(path, hidden=False)]
+    assert not any('/.' in file[len(path):] for file in visible)
+    assert add_lines(path, ['src/']) == 8
 
 
 def test_get_line_count_with_exclusions():
@@ -213,6 +1114,40 @@ def test_get_line_count_with_exclusions():
         'mock_repo/nested_dir_1/nested_dir_2/excluded_dir/excluded_biased_words_file.txt']
     line_count = get_line_count(mock_repo_path, excluded)
     assert line_count == 18
+    # the files rg skips aren't counted and the time budget stops the count
+    assert get_line_count(mock_repo_path, excluded, max_file_size='1') == 0
+    assert get_line_count(mock_repo_path, excluded, out_of_time=lambda: True) == None
+
+
+# Imports that only some runs need must stay out of the startup path
+LAZY_MODULES = ['binaryornot', 'chardet', 'ssl', 'urllib.request', 'sqlite3', 'tarfile',
+                'utils.walker',
+                'tools.event2splunk', 'tools.splunkhecclient']
+# `import run_json` took ~100ms before the Splunk transport and binary
+# detection were made lazy and ~45ms after. Wall clock timings depend on
+# the machine and its load, so the budget is only checked on request:
+# BIASED_LANG_BENCHMARK=1 python -m pytest -k startup_time
+STARTUP_BUDGET_US = 75000
+
+
+def test_lean_startup():
+    check = f'import sys, run_json; print([m for m in {LAZY_MODULES!r} if m in sys.modules])'
+    output = subprocess.run([sys.executable, '-c', check],
+                            capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
+
+
+@pytest.mark.skipif(not os.environ.get('BIASED_LANG_BENCHMARK'),
+                    reason='benchmark, set BIASED_LANG_BENCHMARK=1 to run it')
+def test_startup_time():
+    timings = []
+    for _ in range(5):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import run_json'],
+                                capture_output=True, text=True, check=True)
+        run_json_line = [line for line in output.stderr.splitlines()
+                         if line.endswith('| run_json')][0]
+        timings.append(int(run_json_line.split('|')[1]))
+    assert min(timings) < STARTUP_BUDGET_US
 
 
 def test_timefunction():
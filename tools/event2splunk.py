@@ -13,8 +13,13 @@
 # limitations under the License
 
 import json
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from utils import BiasedLanguageLogger
+from .flowcontrol import FlowController
+from .hecack import AckTracker
 from .splunkhecclient import (SplunkHECClient,
                               SplunkEventBuilder)
 
@@ -32,13 +37,33 @@ class Event2Splunk(object):
 
         # Configure Splunk HEC Client
         self._splunk_env = splunk_env
+        self._flow = FlowController(
+            rate=self._splunk_env.get('hec_rate', 50000),
+            max_window=self._splunk_env.get('hec_max_in_flight', 8))
         self.splunk_client = SplunkHECClient(
             self._splunk_env['hec_protocol'],
             self._splunk_env['hec_host'],
             self._splunk_env['hec_port'],
             self._splunk_env['hec_key'],
-            self._logger
+            self._logger,
+            flow=self._flow,
+            channel=str(uuid.uuid4()) if self._splunk_env.get('hec_ack') else None
         )
+        # With indexer acknowledgement, events only count as ingested once
+        # the indexers confirm them
+        self._acks = None
+        if self._splunk_env.get('hec_ack'):
+            self._acks = AckTracker(
+                self.splunk_client, self._logger,
+                timeout=self._splunk_env.get('hec_ack_timeout', 300),
+                poll_interval=self._splunk_env.get('hec_ack_poll_interval', 1))
+            self._max_pending_acks = self._splunk_env.get('hec_ack_max_pending', 16)
+        # Batches are posted from worker threads, the flow controller
+        # decides how many of them are in flight at any time
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._splunk_env.get('hec_max_in_flight', 8))
+        self._pending = []
+        self._lock = threading.Lock()
 
         # Configure default Event Builder
         self._builder = SplunkEventBuilder()
@@ -69,36 +94,97 @@ class Event2Splunk(object):
                                     indent=4, separators=(',', ': ')))
             return
 
+        if index:
+            self._builder.set_index(index)
+        self._set_envelope(timestamp, source, sourcetype)
+
+        self._total_events += 1
+        self._batch_events.append(self._builder.build_event(payload))
+        self._send_batch(filename)
+
+    # Posts payloads that are already JSON encoded. They share one
+    # timestamp, so the envelope is only encoded once for the whole list.
+    def post_encoded_events(self, encoded_payloads, timestamp=None,
+                            source=None, sourcetype=None, filename=None):
+        if self._dryrun:
+            for encoded_payload in encoded_payloads:
+                self._logger.debug(encoded_payload)
+            return
+
+        self._set_envelope(timestamp, source, sourcetype)
+        for encoded_payload in encoded_payloads:
+            self._total_events += 1
+            self._batch_events.append(
+                self._builder.build_encoded_event(encoded_payload))
+            self._send_batch(filename)
+
+    # Metrics usually live in their own index, so unlike post_event the
+    # index only applies to this data point
+    def post_metric(self, fields, timestamp=None, index=None,
+                    source=None, sourcetype=None, filename=None):
+        if self._dryrun:
+            self._logger.debug(json.dumps(fields, sort_keys=True,
+                                    indent=4, separators=(',', ': ')))
+            return
+
+        self._set_envelope(timestamp, source, sourcetype)
+
+        self._total_events += 1
+        self._batch_events.append(self._builder.build_metric(fields, index))
+        self._send_batch(filename)
+
+    def _set_envelope(self, timestamp, source, sourcetype):
         if timestamp:
             self._builder.set_timestamp(timestamp)
         else:
             self._builder.set_timestamp(time.time())
 
-        if index:
-            self._builder.set_index(index)
         if sourcetype:
             self._builder.set_sourcetype(sourcetype)
         if source:
             self._builder.set_source(source)
 
-        self._total_events += 1
-        self._batch_events.append(self._builder.build_event(payload))
-        self._send_batch(filename)
-
     def _send_batch(self, filename, force=False):
         if ((not force and len(self._batch_events) < self._batch_size)
                 or (force and len(self._batch_events) == 0)):
             return
 
-        if self.splunk_client.post("".join(self._batch_events)):
-            self._ingested_events += len(self._batch_events)
-            self._logger.info(f'Sent {self._ingested_events} events to Splunk HEC')
-
         # Cleanup queued events. Doing this will lose events when sending a post
         # request failed.
-        self._batch_events = []
+        batch, self._batch_events = self._batch_events, []
+        # blocks the caller while the HEC is pushing back
+        self._flow.acquire(len(batch))
+        self._pending.append(self._executor.submit(self._post_batch, batch))
+
+    def _post_batch(self, batch):
+        data = "".join(batch)
+        try:
+            if self._acks is None:
+                if self.splunk_client.post(data):
+                    self._count_ingested(len(batch))
+                return
+            successful, ack_id = self.splunk_client.send(data)
+            if successful:
+                self._acks.add(ack_id, data, len(batch))
+        finally:
+            self._flow.release()
+        # keep a bounded number of batches waiting on their ack
+        if self._acks.pending >= self._max_pending_acks:
+            self._count_ingested(self._acks.poll())
+
+    def _count_ingested(self, count):
+        if not count:
+            return
+        with self._lock:
+            self._ingested_events += count
+            ingested = self._ingested_events
+        self._logger.info(f'Sent {ingested} events to Splunk HEC')
 
     def close(self, filename=None):
         if self._dryrun:
             return
         self._send_batch(filename, force=True)
+        wait(self._pending)
+        self._pending = []
+        if self._acks is not None:
+            self._count_ingested(self._acks.wait())
@@ -0,0 +1,146 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# HTTP statuses the HEC answers with when the indexers can't keep up
+OVERLOAD_STATUSES = (429, 503)
+
+
+# Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value, now=None):
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at - (now or time.time()), 0.0)
+
+
+# Token bucket measured in events per second. A batch larger than the
+# bucket is let through once the bucket is full and leaves it in debt,
+# so big batches are throttled without being blocked forever.
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self._rate = float(rate)
+        self._capacity = float(capacity or rate)
+        self._tokens = self._capacity
+        self._clock = clock
+        self._updated = clock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        self._refill()
+        self._rate = float(rate)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    # Returns how long to wait before `cost` tokens are available, taking
+    # them when no wait is needed.
+    def take(self, cost):
+        self._refill()
+        needed = min(float(cost), self._capacity)
+        if self._tokens >= needed:
+            self._tokens -= cost
+            return 0.0
+        return (needed - self._tokens) / self._rate
+
+
+# Flow control for the HEC posts: a token bucket caps the event rate and
+# an AIMD window caps the number of requests in flight. Every successful
+# response grows both additively, an overloaded one (429/503) halves them
+# and pauses new requests for Retry-After.
+class FlowController(object):
+    def __init__(self, rate=50000, max_rate=None, min_rate=100,
+                 window=2, max_window=8, clock=time.monotonic,
+                 sleep=time.sleep):
+        self._bucket = TokenBucket(rate, clock=clock)
+        self._rate_step = max(rate / 10.0, 1.0)
+        self._min_rate = min_rate
+        self._max_rate = max_rate or rate * 4
+        self._window = float(window)
+        self._max_window = max_window
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Condition()
+
+    @property
+    def window(self):
+        return int(self._window)
+
+    @property
+    def rate(self):
+        return self._bucket.rate
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    # Blocks until a request carrying `cost` events may be sent
+    def acquire(self, cost=1):
+        with self._lock:
+            while True:
+                delay = self._paused_until - self._clock()
+                if delay <= 0 and self._in_flight < self.window:
+                    delay = self._bucket.take(cost)
+                    if delay <= 0:
+                        self._in_flight += 1
+                        return
+                if delay > 0:
+                    # release the lock while sleeping so responses can
+                    # still be recorded
+                    self._lock.release()
+                    try:
+                        self._sleep(delay)
+                    finally:
+                        self._lock.acquire()
+                else:
+                    self._lock.wait()
+
+    def release(self):
+        with self._lock:
+            self._in_flight = max(self._in_flight - 1, 0)
+            self._lock.notify_all()
+
+    # Feeds a HEC response back into the controller
+    def record(self, successful, status=None, retry_after=None):
+        with self._lock:
+            if successful:
+                self._window = min(self._window + 1.0 / self._window,
+                                   float(self._max_window))
+                self._bucket.set_rate(
+                    min(self._bucket.rate + self._rate_step, self._max_rate))
+            elif status in OVERLOAD_STATUSES:
+                self._window = max(self._window / 2.0, 1.0)
+                self._bucket.set_rate(
+                    max(self._bucket.rate / 2.0, self._min_rate))
+            if retry_after:
+                self._paused_until = max(self._paused_until,
+                                         self._clock() + retry_after)
+            self._lock.notify_all()
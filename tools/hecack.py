@@ -0,0 +1,89 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import threading
+import time
+
+
+# Keeps track of the batches posted on a HEC channel until the indexers
+# acknowledge them. Batches are not serialised on their ack: any number
+# of them can be outstanding and all of their ackIds are polled with a
+# single request. A batch that isn't acknowledged within `timeout` is
+# sent again, up to `max_resend` times.
+class AckTracker(object):
+    def __init__(self, client, logger, timeout=300, poll_interval=1,
+                 max_resend=2, clock=time.monotonic, sleep=time.sleep):
+        self._client = client
+        self._logger = logger
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._max_resend = max_resend
+        self._clock = clock
+        self._sleep = sleep
+        # ack_id -> [data, event count, sent at, resends]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def add(self, ack_id, data, count, resends=0):
+        if ack_id is None:
+            self._logger.error('HEC did not return an ackId, is indexer '
+                               'acknowledgement enabled on the token?')
+            return
+        with self._lock:
+            self._pending[ack_id] = [data, count, self._clock(), resends]
+
+    # Polls every outstanding ackId at once and returns the number of
+    # events acknowledged by this poll.
+    def poll(self):
+        with self._poll_lock:
+            with self._lock:
+                ack_ids = list(self._pending)
+            if not ack_ids:
+                return 0
+            statuses = self._client.query_acks(ack_ids) or {}
+            acked, expired = 0, []
+            now = self._clock()
+            with self._lock:
+                for ack_id in ack_ids:
+                    if statuses.get(ack_id):
+                        acked += self._pending.pop(ack_id)[1]
+                    elif now - self._pending[ack_id][2] >= self._timeout:
+                        expired.append(self._pending.pop(ack_id))
+            for data, count, _, resends in expired:
+                self._resend(data, count, resends)
+            return acked
+
+    def _resend(self, data, count, resends):
+        if resends >= self._max_resend:
+            self._logger.error(
+                f'{count} events were never acknowledged by the indexers')
+            return
+        self._logger.warning(
+            f'{count} events not acknowledged after {self._timeout}s, resending')
+        successful, ack_id = self._client.send(data)
+        if successful:
+            self.add(ack_id, data, count, resends + 1)
+
+    # Polls until nothing is outstanding, returns the acknowledged events
+    def wait(self):
+        acked = self.poll()
+        while self.pending:
+            self._sleep(self._poll_interval)
+            acked += self.poll()
+        return acked
@@ -20,6 +20,7 @@ import time
 import json
 from urllib import request, error, parse
 from utils import TimeFunction
+from .flowcontrol import parse_retry_after
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -29,55 +30,101 @@ def get_lib_dir(base_dir):
 sys.path.append(get_lib_dir(BASE_DIR))
 
 class SplunkHECClient(object):
-    def __init__(self, protocol, server, port, hec_key, logger):
+    def __init__(self, protocol, server, port, hec_key, logger, flow=None,
+                 channel=None):
         self._max_retry = 3
         self._retry_delay = 10
         self._timeout = 10
         self._protocol = protocol
         self._url = f"{protocol}://{server}:{port}/services/collector/event"
+        self._ack_url = f"{protocol}://{server}:{port}/services/collector/ack"
         self._headers = {'Authorization': hec_key}
         self._method = 'POST'
         self._logger = logger
+        self._flow = flow
+        # Indexer acknowledgement needs every request on a channel
+        self._channel = channel
+        if channel:
+            self._headers['X-Splunk-Request-Channel'] = channel
+            self._ack_url += '?' + parse.urlencode({'channel': channel})
         self._logger.debug(f'HEC URL: {self._url}')
 
+    @property
+    def channel(self):
+        return self._channel
+
     def post(self, data):
+        successful, _ = self.send(data)
+        return successful
+
+    # Like post, but also returns the ackId the HEC assigned to the
+    # request when indexer acknowledgement is enabled on the channel.
+    def send(self, data):
         post_timer = TimeFunction('SplunkHECPost', self._logger)
         post_timer.start()
         successful = False
         msg = None
+        body = None
         retry = 0
         while not successful and retry < self._max_retry:
             retry += 1
-            successful, msg = self._post(data)
-            if not successful:
-                retry_delay = self._retry_delay * retry
+            successful, msg, status, retry_after, body = self._post(data)
+            if self._flow is not None:
+                self._flow.record(successful, status, retry_after)
+            if not successful and retry < self._max_retry:
+                # the HEC knows best when it can take more data
+                retry_delay = retry_after
+                if retry_delay is None:
+                    retry_delay = self._retry_delay * retry
                 self._logger.warning(msg)
                 self._logger.warning(f'Will retry { retry_delay }s later')
-                time.sleep(self._retry_delay * retry)
+                time.sleep(retry_delay)
         if not successful:
             self._logger.error(msg)
         post_timer.stop()
-        return successful
+        ack_id = None
+        if successful and self._channel:
+            ack_id = self._parse_body(body).get('ackId')
+        return successful, ack_id
+
+    # Asks the HEC which of the given ackIds have been indexed. Returns
+    # {ack_id: bool}, or None when the status couldn't be fetched.
+    def query_acks(self, ack_ids):
+        data = json.dumps({'acks': list(ack_ids)})
+        successful, msg, _, _, body = self._post(data, self._ack_url)
+        if not successful:
+            self._logger.warning(msg)
+            return None
+        acks = self._parse_body(body).get('acks', {})
+        return {int(ack_id): indexed for ack_id, indexed in acks.items()}
+
+    def _parse_body(self, body):
+        try:
+            return json.loads(body or '{}')
+        except ValueError:
+            self._logger.warning(f'Unexpected HEC response: {body}')
+            return {}
 
-    def _post(self, data):
+    def _post(self, data, url=None):
         ctx = None
         if self._protocol == 'https':
             ctx = ssl.create_default_context()
             ctx.check_hostname = False
             ctx.verify_mode = ssl.CERT_NONE
         try:
-            requestObj = request.Request(url=self._url, data=data.encode(),
+            requestObj = request.Request(url=url or self._url, data=data.encode(),
                                          headers=self._headers,
                                          method=self._method)
-            request.urlopen(requestObj, timeout=self._timeout, context=ctx)
-            return True, None
+            with request.urlopen(requestObj, timeout=self._timeout, context=ctx) as response:
+                return True, None, response.status, None, response.read().decode()
         except request.HTTPError as e:
             msg = (f"Failed to post Splunk Event, code: {e.code}" +
                    f", reason: {e.reason}")
-            return False, msg
+            retry_after = parse_retry_after(e.headers.get('Retry-After'))
+            return False, msg, e.code, retry_after, None
         except Exception as e:
             msg = f"Failed to post Splunk Event, error: {e}"
-            return False, msg
+            return False, msg, None, None, None
 
 class SplunkEventBuilder(object):
     def __init__(self):
@@ -87,6 +134,7 @@ class SplunkEventBuilder(object):
         self._source_type = ""
         self._defaults = {}
         self._payload = {}
+        self._envelope = None
 
         try:
             self._hostname = socket.gethostname()
@@ -95,23 +143,47 @@ class SplunkEventBuilder(object):
 
     def set_index(self, index):
         self._index = index
+        self._envelope = None
 
     def set_source(self, source):
         self._source = source
+        self._envelope = None
 
     def set_sourcetype(self, source_type):
         self._source_type = source_type
+        self._envelope = None
 
     def set_timestamp(self, unixtime):
         self._timestamp = unixtime
+        self._envelope = None
 
     def build_event(self, payload):
+        return self.build_encoded_event(json.dumps(payload))
+
+    # Wraps an already JSON encoded payload. The envelope around it is
+    # encoded once and reused until one of its fields changes.
+    def build_encoded_event(self, encoded_payload):
+        if self._envelope is None:
+            data = {
+                "source": self._source,
+                "index": self._index,
+                "sourcetype": self._source_type,
+                "host": self._hostname,
+                "time": str(self._timestamp)
+            }
+            self._envelope = json.dumps(data)[:-1] + ', "event": '
+        return self._envelope + encoded_payload + '}'
+
+    # HEC multi-metric format: every "metric_name:<name>" field is a
+    # measurement, the other fields are its dimensions
+    def build_metric(self, fields, index=None):
         data = {
             "source": self._source,
-            "index": self._index,
+            "index": index or self._index,
             "sourcetype": self._source_type,
             "host": self._hostname,
             "time": str(self._timestamp),
-            "event": payload
+            "event": "metric",
+            "fields": fields
         }
-        return json.dumps(data)
\ No newline at end of file
+        return json.dumps(data)
@@ -1,6 +1,47 @@
-import sys
-import os
-from .utils import get_hec_info, get_colors, get_batch_info
-from .utils import truncate_line, get_source_type, send_codeclimate_batch, open_csv
-from .utils import write_file, grab_repo_name, process_and_return_exclusions, add_lines
-from .utils import TimeFunction, BiasedLanguageLogger, get_line_count, is_json, rgignore_cleanup
+import importlib
+
+# Public name -> submodule defining it. Submodules are imported the first
+# time one of their names is used, so `import utils` stays cheap and runs
+# only pay for the features they use.
+_EXPORTS = {
+    'utils': ['get_hec_info', 'get_colors', 'get_batch_info',
+              'get_source_type', 'send_codeclimate_batch', 'open_csv',
+              'write_file', 'grab_repo_name', 'process_and_return_exclusions',
+              'read_exclusions', 'add_lines', 'get_is_binary', 'TimeFunction',
+              'BiasedLanguageLogger', 'get_line_count', 'is_json',
+              'rgignore_cleanup', 'count_lines'],
+    'snippet': ['truncate_line', 'get_match_offsets', 'find_literal_offsets'],
+    'aggregate': ['MatchAggregator'],
+    'shard': ['parse_shard', 'in_shard', 'list_shard_files', 'is_searchable',
+              'has_nested_excludes', 'walk_shard', 'parse_file_size', 'chunk_files',
+              'combine_rg_summaries', 'merge_summaries', 'merge_codeclimate'],
+    'rollup': ['build_rollups', 'sample_events', 'send_rollup_batch'],
+    'encoding': ['encode_occurrences', 'join_encoded', 'encode_splunk_events',
+                 'write_encoded_list', 'send_encoded_batch'],
+    'baseline': ['load_baseline', 'write_baseline'],
+    'delta': ['DeltaState'],
+    'governor': ['ResourceGovernor', 'get_max_rss'],
+    'occurrence_db': ['OccurrenceDB', 'DBDeltaState'],
+    'pipeline': ['ReportPipeline'],
+    'consolidate': ['LineConsolidator'],
+    'archives': ['ArchiveScanner', 'find_archives', 'is_archive'],
+    'trigram': ['TrigramIndex'],
+    'walker': ['Walker', 'IgnoreMatcher'],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items()
+            for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    module = importlib.import_module(f'.{_MODULES[name]}', __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,97 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import os
+
+
+# Collects per-file match stats for every biased word in a single pass.
+# File paths are interned to integer ids so the set of matched files and
+# the file x term matrix never hold more than one copy of each path.
+class MatchAggregator:
+    def __init__(self, root=None):
+        self._root = root
+        self._file_ids = {}
+        self._paths = []
+        self._matched = set()
+        # file id -> {biased_word: [num_matched_lines, num_matched_words]}
+        self._matrix = {}
+
+    def file_id(self, path):
+        file_id = self._file_ids.get(path)
+        if file_id is None:
+            file_id = len(self._paths)
+            self._file_ids[path] = file_id
+            self._paths.append(path)
+        return file_id
+
+    def add(self, biased_word, path, matched_lines, matches):
+        file_id = self.file_id(path)
+        self._matched.add(file_id)
+        terms = self._matrix.setdefault(file_id, {})
+        counts = terms.setdefault(biased_word, [0, 0])
+        counts[0] += matched_lines
+        counts[1] += matches
+
+    @property
+    def total_files_matched(self):
+        return len(self._matched)
+
+    def relative_path(self, path):
+        if self._root and path.startswith(self._root + '/'):
+            return path[len(self._root)+1:]
+        return path
+
+    def file_matrix(self):
+        matrix = {}
+        for file_id, terms in self._matrix.items():
+            matrix[self.relative_path(self._paths[file_id])] = {
+                word: {'num_matched_lines': lines, 'num_matched_words': words}
+                for word, (lines, words) in terms.items()
+            }
+        return matrix
+
+    def term_rollup(self):
+        rollup = {}
+        for terms in self._matrix.values():
+            for word, (lines, words) in terms.items():
+                entry = rollup.setdefault(word, {
+                    'num_matched_files': 0,
+                    'num_matched_lines': 0,
+                    'num_matched_words': 0
+                })
+                entry['num_matched_files'] += 1
+                entry['num_matched_lines'] += lines
+                entry['num_matched_words'] += words
+        return rollup
+
+    # Rolls the matrix up to directories, truncated to `depth` path
+    # components. Files at the top level are grouped under '.'
+    def directory_rollup(self, depth=1):
+        rollup = {}
+        for file_id, terms in self._matrix.items():
+            directory = os.path.dirname(
+                self.relative_path(self._paths[file_id]))
+            directory = '/'.join(directory.split('/')[:depth]) or '.'
+            entry = rollup.setdefault(directory, {
+                'num_matched_files': 0,
+                'num_matched_lines': 0,
+                'num_matched_words': 0,
+                'terms': {}
+            })
+            entry['num_matched_files'] += 1
+            for word, (lines, words) in terms.items():
+                entry['num_matched_lines'] += lines
+                entry['num_matched_words'] += words
+                entry['terms'][word] = entry['terms'].get(word, 0) + lines
+        return rollup
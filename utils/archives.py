@@ -0,0 +1,174 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import io
+import json
+import re
+import tarfile
+import zipfile
+import constants
+from .shard import combine_rg_summaries, walk_shard
+
+def is_archive(path):
+    return path.lower().endswith(constants.ARCHIVE_EXTENSIONS)
+
+
+# Archives under `path` that rg would search, honouring the same ignore
+# files. `shard` is the (index, count) of a sharded run, which only gets
+# the archives in its own slice.
+def find_archives(path, shard=None):
+    return [file for file, _ in walk_shard(path, shard) if is_archive(file)]
+
+
+def rg_json(entry_type, data):
+    return json.dumps({'type': entry_type, 'data': data},
+                      separators=(',', ':'))
+
+
+# Searches the text members of archives without extracting them and
+# produces the same entries `rg --json` would for each term, with
+# 'archive!member' paths. Every member is read once for all the terms.
+class ArchiveScanner(object):
+    def __init__(self, terms, max_member_size=constants.ARCHIVE_MAX_MEMBER_SIZE,
+                 max_depth=constants.ARCHIVE_MAX_DEPTH, logger=None):
+        self._patterns = [(term, re.compile(term, re.IGNORECASE))
+                          for term in terms]
+        self._max_member_size = max_member_size
+        self._max_depth = max_depth
+        self._logger = logger
+        # term -> rg entries, and the stats for its summary
+        self._entries = {term: [] for term in terms}
+        self._stats = {term: {'matched_lines': 0, 'matches': 0, 'searches': 0,
+                              'searches_with_match': 0} for term in terms}
+        self.skipped = []
+
+    # `governor` stops the scan between archives once the run is out of budget
+    def scan(self, archives, governor=None):
+        for archive in archives:
+            if governor is not None and governor.exhausted():
+                break
+            try:
+                with open(archive, 'rb') as fileobj:
+                    self._scan_archive(archive, fileobj, 1)
+            except (OSError, zipfile.BadZipFile, tarfile.TarError) as error:
+                self._skip(archive, error)
+        return self
+
+    # The rg entries of `term`, ending with a summary. `results`, the
+    # output of the regular search, comes first and its summary is
+    # folded into the combined one.
+    def results(self, term, results=()):
+        summaries = []
+        try:
+            for result in results:
+                if '"type":"summary"' in result:
+                    summaries.append(json.loads(result))
+                else:
+                    yield result
+        finally:
+            if hasattr(results, 'close'):
+                results.close()
+        yield from self._entries.get(term, [])
+        stats = self._stats.get(term, {})
+        summaries.append({'type': 'summary', 'data': {'stats': stats}})
+        yield rg_json('summary', combine_rg_summaries(summaries)['data'])
+
+    def _skip(self, path, reason):
+        self.skipped.append(path)
+        if self._logger is not None:
+            self._logger.warning(f'Skipping {path}: {reason}')
+
+    def _scan_archive(self, path, fileobj, depth):
+        if path.lower().endswith(('.tar', '.tar.gz', '.tgz')):
+            with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    self._scan_member(
+                        f'{path}!{member.name}', member.size, depth,
+                        lambda member=member: archive.extractfile(member))
+        else:
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    self._scan_member(
+                        f'{path}!{info.filename}', info.file_size, depth,
+                        lambda info=info: archive.open(info))
+
+    def _scan_member(self, member_path, size, depth, open_member):
+        if size > self._max_member_size:
+            self._skip(member_path, f'larger than {self._max_member_size} bytes')
+            return
+        with open_member() as member:
+            # sizes in the headers can't be trusted
+            content = member.read(self._max_member_size + 1)
+        if len(content) > self._max_member_size:
+            self._skip(member_path, f'larger than {self._max_member_size} bytes')
+            return
+        if is_archive(member_path):
+            if depth >= self._max_depth:
+                self._skip(member_path, f'nested deeper than {self._max_depth}')
+                return
+            try:
+                self._scan_archive(member_path, io.BytesIO(content), depth + 1)
+            except (zipfile.BadZipFile, tarfile.TarError) as error:
+                self._skip(member_path, error)
+            return
+        if b'\0' in content[:constants.BINARY_CHECK_LEN]:
+            return
+        self._search(member_path, content.decode('utf-8', 'replace'))
+
+    def _search(self, member_path, text):
+        for term, pattern in self._patterns:
+            stats = self._stats[term]
+            stats['searches'] += 1
+            matched = []
+            line_number, position = 1, 0
+            for match in pattern.finditer(text):
+                line_start = text.rfind('\n', 0, match.start()) + 1
+                if not matched or matched[-1][0] != line_start:
+                    line_number += text.count('\n', position, line_start)
+                    position = line_start
+                    matched.append((line_start, line_number, []))
+                # rg reports byte offsets into the line
+                start = len(text[line_start:match.start()].encode('utf-8'))
+                matched[-1][2].append({
+                    'match': {'text': match.group()},
+                    'start': start,
+                    'end': start + len(match.group().encode('utf-8'))
+                })
+            if not matched:
+                continue
+
+            entries = self._entries[term]
+            entries.append(rg_json('begin', {'path': {'text': member_path}}))
+            matches = 0
+            for line_start, line_number, submatches in matched:
+                line_end = text.find('\n', line_start)
+                line = text[line_start:line_end + 1 if line_end != -1 else None]
+                matches += len(submatches)
+                entries.append(rg_json('match', {
+                    'path': {'text': member_path},
+                    'lines': {'text': line},
+                    'line_number': line_number,
+                    'submatches': submatches
+                }))
+            entries.append(rg_json('end', {
+                'path': {'text': member_path},
+                'stats': {'matched_lines': len(matched), 'matches': matches}
+            }))
+            stats['searches_with_match'] += 1
+            stats['matched_lines'] += len(matched)
+            stats['matches'] += matches
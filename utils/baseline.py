@@ -0,0 +1,36 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import os
+
+
+# A baseline is a text file of known occurrence fingerprints, one per
+# line and sorted so regenerating it gives small diffs. Blank lines and
+# '#' comments are ignored.
+def load_baseline(path):
+    if not os.path.exists(path):
+        raise Exception(f'Baseline file {path} not found, create it with --update_baseline')
+    with open(path) as baseline_file:
+        fingerprints = set()
+        for line in baseline_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                fingerprints.add(line)
+    return fingerprints
+
+
+def write_baseline(path, fingerprints):
+    with open(path, 'w') as baseline_file:
+        for fingerprint in sorted(set(fingerprints)):
+            baseline_file.write(fingerprint + '\n')
@@ -0,0 +1,98 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import hashlib
+import constants
+from .snippet import (MAX_SNIPPETS, truncate_line, get_match_offsets,
+                      find_literal_offsets)
+
+
+# Folds the matches of every term into one record per (file, line) for
+# --consolidate. Lines are kept raw until report() so each one is only
+# cut down to snippets once, with the matches of all its terms.
+class LineConsolidator(object):
+    def __init__(self, max_line_len=constants.MAX_LINE_LEN):
+        self._max_line_len = max_line_len
+        # (path, line_number) -> [raw line, is_text, terms, submatches]
+        self._lines = {}
+
+    # `match` is the untruncated Occurrence parse_match built out of the
+    # rg match `entry`
+    def add(self, match, entry):
+        key = (match.path, match.line_number)
+        record = self._lines.get(key)
+        if record is None:
+            lines = entry['data']['lines']
+            record = [lines.get('text', lines.get('bytes')),
+                      'text' in lines, [], []]
+            self._lines[key] = record
+        if match.biased_word not in record[2]:
+            record[2].append(match.biased_word)
+        for submatch in entry['data']['submatches']:
+            record[3].append(dict(submatch, biased_word=match.biased_word))
+
+    def __len__(self):
+        return len(self._lines)
+
+    # The codeclimate records, and their Splunk events when splunk_flag
+    def report(self, batch_info, splunk_flag=False):
+        report, events = [], []
+        for (path, line_number), (raw_line, is_text, terms, submatches) \
+                in self._lines.items():
+            submatches.sort(key=lambda submatch: submatch['start'])
+            string = '%s-%s-%s-%s' % (
+                ','.join(terms), path, line_number, raw_line)
+            label = 'term' if len(terms) == 1 else 'terms'
+            occurrence = {
+                'description': f'Biased {label} found: {", ".join(terms)}',
+                'location': {
+                    'path': path,
+                    'lines': {
+                        'begin': line_number
+                    }
+                },
+                'fingerprint': hashlib.md5(string.encode('utf-8')).hexdigest(),
+                'biased_words': terms,
+                'matches': [{'biased_word': submatch['biased_word'],
+                             'start': submatch['start'],
+                             'end': submatch['end']}
+                            for submatch in submatches]
+            }
+            report.append(occurrence)
+            if not splunk_flag:
+                continue
+            line, is_truncated = self._snippet(
+                raw_line, is_text, terms, submatches)
+            splunk_info = {
+                'line_truncated': is_truncated,
+                'line': line,
+                'content': constants.CODECLIMATE_FILENAME
+            }
+            splunk_info.update(batch_info)
+            splunk_info.update(occurrence)
+            events.append(splunk_info)
+        return report, events
+
+    def _snippet(self, raw_line, is_text, terms, submatches):
+        line = raw_line.strip()
+        if len(line) <= self._max_line_len:
+            return line, False
+        if is_text:
+            offsets = get_match_offsets(submatches, raw_line)
+        else:
+            # base64'd lines: rg's byte offsets don't line up with the text
+            offsets = sorted(offset for term in terms
+                             for offset in find_literal_offsets(line, term))
+            offsets = offsets[:MAX_SNIPPETS]
+        return truncate_line(line, terms[0], self._max_line_len, offsets), True
@@ -0,0 +1,81 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import json
+import os
+import constants
+from .encoding import join_encoded
+
+ADDED = 'added'
+RESOLVED = 'resolved'
+
+
+# Snapshot of the occurrences a repo had on its last run that made it to
+# Splunk, kept as {fingerprint: codeclimate occurrence} in one JSON file
+# per repo. Only the difference with it needs to be sent again.
+class DeltaState(object):
+    def __init__(self, state_dir, repo_name):
+        self._path = os.path.join(
+            state_dir, repo_name.strip('/').replace('/', '__') + '.json')
+        self._occurrences = None
+
+    @property
+    def path(self):
+        return self._path
+
+    # Occurrences of the last run, empty when there is no snapshot yet
+    def load(self):
+        if self._occurrences is None:
+            self._occurrences = {}
+            if os.path.exists(self._path):
+                with open(self._path) as state_file:
+                    self._occurrences = json.load(state_file)['occurrences']
+        return self._occurrences
+
+    def save(self, report, batch_info):
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        state = {
+            'uuid': batch_info.get('uuid'),
+            'time': batch_info.get('time'),
+            'occurrences': {occurrence['fingerprint']: occurrence
+                            for occurrence in report}
+        }
+        # write aside and rename, so a failed run never leaves half a state
+        with open(self._path + '.tmp', 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(self._path + '.tmp', self._path)
+        self._occurrences = state['occurrences']
+
+    # Returns the (fingerprint, encoded payload) pairs to send: the added
+    # occurrences out of `encoded_events` and a payload for each resolved
+    # one, all tagged with a 'delta' field.
+    def diff(self, report, encoded_events, batch_info):
+        previous = self.load()
+        current = set()
+        changes = []
+        for occurrence, encoded_event in zip(report, encoded_events):
+            current.add(occurrence['fingerprint'])
+            if occurrence['fingerprint'] not in previous:
+                changes.append((occurrence['fingerprint'], join_encoded(
+                    json.dumps({'delta': ADDED}), encoded_event)))
+        num_added = len(changes)
+
+        encoded_batch_info = json.dumps(batch_info)
+        for fingerprint, occurrence in previous.items():
+            if fingerprint not in current:
+                changes.append((fingerprint, join_encoded(
+                    json.dumps({'delta': RESOLVED,
+                                'content': constants.CODECLIMATE_FILENAME}),
+                    encoded_batch_info, json.dumps(occurrence))))
+        return changes, {ADDED: num_added, RESOLVED: len(changes) - num_added}
@@ -0,0 +1,82 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import json
+import time
+
+# Splunk-only fields of an event, in the order process_word_occurrences
+# puts them ahead of the batch info and the codeclimate occurrence.
+SPLUNK_FIELDS = ('line_truncated', 'line', 'content')
+
+
+def encode_occurrences(report):
+    return [json.dumps(occurrence) for occurrence in report]
+
+
+# Splices JSON objects together without decoding them again, the result
+# is the same as json.dumps of the merged dicts.
+def join_encoded(*encoded_objects):
+    members = [encoded[1:-1] for encoded in encoded_objects
+               if encoded != '{}']
+    return '{' + ', '.join(members) + '}'
+
+
+# Builds the Splunk payloads out of the already encoded occurrences, the
+# batch info is encoded once for the whole run. events[i] must be the
+# Splunk event of report[i], as process_biased_word_line collects them.
+def encode_splunk_events(events, encoded_report, batch_info,
+                         encoded_batch_info=None):
+    if encoded_batch_info is None:
+        encoded_batch_info = json.dumps(batch_info)
+    return [
+        join_encoded(
+            json.dumps({key: event[key] for key in SPLUNK_FIELDS}),
+            encoded_batch_info, encoded_occurrence)
+        for event, encoded_occurrence in zip(events, encoded_report)
+    ]
+
+
+# Writes a JSON list out of already encoded items, one per line, as they
+# come in. The list is only closed by close().
+class EncodedListWriter(object):
+    def __init__(self, file):
+        self._outfile = open(file, 'w')
+        self._empty = True
+
+    def write(self, encoded_items):
+        if not encoded_items:
+            return
+        self._outfile.write(',\n  ' if not self._empty else '[\n  ')
+        self._outfile.write(',\n  '.join(encoded_items))
+        self._empty = False
+
+    def close(self):
+        self._outfile.write('[]\n' if self._empty else '\n]\n')
+        self._outfile.close()
+
+
+# Same content as write_file, with one occurrence per line so the
+# encoded occurrences are written as they are.
+def write_encoded_list(file, encoded_items):
+    writer = EncodedListWriter(file)
+    writer.write(encoded_items)
+    writer.close()
+
+
+def send_encoded_batch(codeclimate_filename, encoded_payloads, repo_name,
+                       source_type, event2splunk):
+    event2splunk.post_encoded_events(
+        encoded_payloads, timestamp=time.time(), source=repo_name,
+        sourcetype=source_type, filename=codeclimate_filename)
+    event2splunk.close(codeclimate_filename)
@@ -0,0 +1,93 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import sys
+import time
+
+TIME_BUDGET = 'time_budget'
+MAX_RSS = 'max_rss'
+TERM_TIMEOUT = 'term_timeout'
+
+
+# Peak resident set size of this process in MB, 0 where the resource
+# module isn't available
+def get_max_rss():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    return max_rss // 1024
+
+
+# Keeps a run within its budgets: a wall clock budget (seconds) and a peak
+# RSS (MB) for the whole run, which stop it, and a timeout (seconds) for
+# each term's search, which only cuts that term short. The limits that
+# were hit are listed in `limits_hit` for the summary.
+class ResourceGovernor(object):
+    def __init__(self, time_budget=None, max_rss=None, term_timeout=None,
+                 clock=time.monotonic, max_rss_func=get_max_rss):
+        self._time_budget = time_budget
+        self._max_rss = max_rss
+        self._term_timeout = term_timeout
+        self._clock = clock
+        self._max_rss_func = max_rss_func
+        self._start = clock()
+        self._deadline = None
+        self._deadline_limit = None
+        self.limits_hit = []
+
+    def hit(self, limit):
+        if limit not in self.limits_hit:
+            self.limits_hit.append(limit)
+
+    # A term's search ends at its timeout or at the end of the time
+    # budget, whichever comes first
+    def start_search(self):
+        self._deadline, self._deadline_limit = None, None
+        if self._term_timeout is not None:
+            self._deadline = self._clock() + self._term_timeout
+            self._deadline_limit = TERM_TIMEOUT
+        if self._time_budget is not None:
+            end = self._start + self._time_budget
+            if self._deadline is None or end < self._deadline:
+                self._deadline, self._deadline_limit = end, TIME_BUDGET
+
+    # Seconds left for the current search, None when it has no deadline
+    def search_timeout(self):
+        if self._deadline is None:
+            return None
+        return max(self._deadline - self._clock(), 0)
+
+    def search_timed_out(self):
+        self.hit(self._deadline_limit)
+
+    # Whether the time budget is spent. Unlike exhausted() it doesn't
+    # count as a limit hit, so work around the scan can stop on it too.
+    def out_of_time(self):
+        return (self._time_budget is not None
+                and self._clock() - self._start >= self._time_budget)
+
+    # True once a budget that stops the whole run is spent
+    def exhausted(self):
+        if (self._time_budget is not None
+                and self._clock() - self._start >= self._time_budget):
+            self.hit(TIME_BUDGET)
+        if (self._max_rss is not None
+                and self._max_rss_func() >= self._max_rss):
+            self.hit(MAX_RSS)
+        return TIME_BUDGET in self.limits_hit or MAX_RSS in self.limits_hit
@@ -0,0 +1,173 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import json
+import sqlite3
+from .delta import DeltaState
+
+TERM_PREFIX = 'Biased term found: '
+TERMS_PREFIX = 'Biased terms found: '
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT UNIQUE,
+    repo TEXT NOT NULL,
+    time REAL,
+    terms_found INTEGER,
+    total_lines_matched INTEGER,
+    total_words_matched INTEGER,
+    total_files_matched INTEGER,
+    incomplete INTEGER DEFAULT 0,
+    -- set once every event of the run reached Splunk
+    delivered INTEGER DEFAULT 0,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    repo TEXT NOT NULL,
+    term TEXT NOT NULL,
+    path TEXT NOT NULL,
+    line INTEGER,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_repo ON runs (repo, id);
+CREATE INDEX IF NOT EXISTS occurrences_run ON occurrences (run_id);
+CREATE INDEX IF NOT EXISTS occurrences_term ON occurrences (repo, term);
+CREATE INDEX IF NOT EXISTS occurrences_path ON occurrences (repo, path);
+CREATE INDEX IF NOT EXISTS occurrences_fingerprint ON occurrences (fingerprint);
+'''
+
+# id of the last run of each repo
+LATEST_RUNS = 'SELECT MAX(id) FROM runs GROUP BY repo'
+
+
+# Local index of every run's summary and occurrences, to answer "where is
+# this term still used" without Splunk or a new scan.
+class OccurrenceDB(object):
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    # One transaction per run, the occurrences are inserted in batches.
+    # A consolidated record gets a row for each of its terms, all with the
+    # record's fingerprint.
+    def record_run(self, repo, batch_info, summary, report, batch_size=10000):
+        with self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO runs (uuid, repo, time, terms_found, total_lines_matched, '
+                'total_words_matched, total_files_matched, incomplete, summary) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (batch_info['uuid'], repo, float(batch_info['time'].split('_')[0]),
+                 summary['terms_found'], summary['total_lines_matched'],
+                 summary['total_words_matched'], summary['total_files_matched'],
+                 summary.get('incomplete', False), json.dumps(summary)))
+            run_id = cursor.lastrowid
+            for start in range(0, len(report), batch_size):
+                self._connection.executemany(
+                    'INSERT INTO occurrences (run_id, repo, term, path, line, fingerprint) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(run_id, repo, term, occurrence['location']['path'],
+                      occurrence['location']['lines']['begin'],
+                      occurrence['fingerprint'])
+                     for occurrence in report[start:start + batch_size]
+                     for term in occurrence.get('biased_words') or
+                     [occurrence['description'][len(TERM_PREFIX):]]])
+        return run_id
+
+    def mark_delivered(self, uuid):
+        with self._connection:
+            self._connection.execute(
+                'UPDATE runs SET delivered = 1 WHERE uuid = ?', (uuid,))
+
+    # Codeclimate occurrences of the repo's last run that reached Splunk,
+    # the rows of a consolidated record are put back together
+    def delivered_occurrences(self, repo):
+        rows = self._connection.execute(
+            'SELECT term, path, line, fingerprint FROM occurrences WHERE run_id = '
+            '(SELECT MAX(id) FROM runs WHERE repo = ? AND delivered = 1) '
+            'ORDER BY rowid', (repo,))
+        occurrences, terms = {}, {}
+        for row in rows:
+            if row['fingerprint'] not in occurrences:
+                occurrences[row['fingerprint']] = {
+                    'location': {'path': row['path'], 'lines': {'begin': row['line']}},
+                    'fingerprint': row['fingerprint']
+                }
+                terms[row['fingerprint']] = []
+            terms[row['fingerprint']].append(row['term'])
+        for fingerprint, occurrence in occurrences.items():
+            prefix = TERM_PREFIX if len(terms[fingerprint]) == 1 else TERMS_PREFIX
+            occurrence['description'] = prefix + ', '.join(terms[fingerprint])
+        return occurrences
+
+    # Counts per term over the last run of each repo (or of `repo`)
+    def term_counts(self, repo=None):
+        return self._query(
+            'SELECT term, COUNT(*) AS num_matched_lines, '
+            'COUNT(DISTINCT repo || char(0) || path) AS num_matched_files, '
+            'COUNT(DISTINCT repo) AS num_repos FROM occurrences '
+            f'WHERE run_id IN ({LATEST_RUNS}) AND (? IS NULL OR repo = ?) '
+            'GROUP BY term ORDER BY num_matched_lines DESC, term',
+            (repo, repo))
+
+    # Counts per file over the last run of each repo, optionally for one term
+    def path_counts(self, repo=None, term=None):
+        return self._query(
+            'SELECT repo, path, COUNT(*) AS num_matched_lines FROM occurrences '
+            f'WHERE run_id IN ({LATEST_RUNS}) AND (? IS NULL OR repo = ?) '
+            'AND (? IS NULL OR term = ?) '
+            'GROUP BY repo, path ORDER BY num_matched_lines DESC, repo, path',
+            (repo, repo, term, term))
+
+    # Matched lines of every run, oldest first
+    def trend(self, repo=None, term=None):
+        return self._query(
+            'SELECT runs.repo, runs.uuid, runs.time, COUNT(occurrences.run_id) '
+            'AS num_matched_lines FROM runs LEFT JOIN occurrences '
+            'ON occurrences.run_id = runs.id AND (? IS NULL OR occurrences.term = ?) '
+            'WHERE (? IS NULL OR runs.repo = ?) GROUP BY runs.id ORDER BY runs.id',
+            (term, term, repo, repo))
+
+    def _query(self, sql, params):
+        return [dict(row) for row in self._connection.execute(sql, params)]
+
+
+# Delta state kept in the occurrence index instead of a snapshot file:
+# the baseline is the last run of the repo that was fully delivered
+class DBDeltaState(DeltaState):
+    def __init__(self, db, repo_name):
+        self._db = db
+        self._repo = repo_name
+        self._occurrences = None
+
+    @property
+    def path(self):
+        return self._db.path
+
+    def load(self):
+        if self._occurrences is None:
+            self._occurrences = self._db.delivered_occurrences(self._repo)
+        return self._occurrences
+
+    # the run itself was recorded by record_run
+    def save(self, report, batch_info):
+        self._db.mark_delivered(batch_info['uuid'])
+        self._occurrences = {occurrence['fingerprint']: occurrence
+                             for occurrence in report}
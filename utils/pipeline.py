@@ -0,0 +1,92 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import json
+import queue
+import threading
+import time
+from .encoding import (EncodedListWriter, encode_occurrences,
+                       encode_splunk_events)
+
+_DONE = object()
+
+
+# Consumer side of the scan: each term's occurrences are handed over as
+# soon as its search is done, and encoded, appended to the codeclimate
+# file and posted to the `sinks` on a worker thread while the next terms
+# are searched. The queue is bounded so a slow HEC holds the scan back
+# instead of piling up occurrences.
+class ReportPipeline(object):
+    def __init__(self, codeclimate_file, batch_info, encode_events=False,
+                 sinks=(), repo_name=None, source_type=None, maxsize=4):
+        self._writer = EncodedListWriter(codeclimate_file)
+        self._codeclimate_file = codeclimate_file
+        self._batch_info = batch_info
+        self._encoded_batch_info = json.dumps(batch_info)
+        self._encode_events = encode_events or bool(sinks)
+        self._sinks = sinks
+        self._repo_name = repo_name
+        self._source_type = source_type
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self.encoded_report = []
+        self.encoded_events = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Blocks while the queue is full
+    def put(self, report, events):
+        if self._error is None:
+            self._queue.put((report, events))
+
+    # Waits for the worker to drain the queue and closes the codeclimate
+    # file and the sinks' occurrence batches
+    def finish(self):
+        self._queue.put(_DONE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        for event2splunk in self._sinks:
+            event2splunk.close(self._codeclimate_file)
+        return self.encoded_report, self.encoded_events
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                self._consume(*item)
+        except Exception as error:
+            self._error = error
+            # keep taking items so the producer never blocks on a dead worker
+            while self._queue.get() is not _DONE:
+                pass
+        finally:
+            self._writer.close()
+
+    def _consume(self, report, events):
+        encoded_report = encode_occurrences(report)
+        self._writer.write(encoded_report)
+        self.encoded_report += encoded_report
+        if not self._encode_events:
+            return
+        encoded_events = encode_splunk_events(
+            events, encoded_report, self._batch_info, self._encoded_batch_info)
+        self.encoded_events += encoded_events
+        timestamp = time.time()
+        for event2splunk in self._sinks:
+            event2splunk.post_encoded_events(
+                encoded_events, timestamp=timestamp, source=self._repo_name,
+                sourcetype=self._source_type, filename=self._codeclimate_file)
@@ -0,0 +1,68 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import constants
+
+METRIC_PREFIX = 'biased_lang.'
+
+
+# Flattens the aggregator into (dimensions, counts) rows: one per term,
+# one per (file, term) pair and one per directory. The same rows are sent
+# either as compact events or as metrics.
+def build_rollups(aggregator, depth=1):
+    rollups = []
+    for word, counts in aggregator.term_rollup().items():
+        rollups.append(({'rollup': 'term', 'biased_word': word}, counts))
+    for path, terms in aggregator.file_matrix().items():
+        for word, counts in terms.items():
+            rollups.append(({'rollup': 'file', 'path': path,
+                             'biased_word': word}, counts))
+    for directory, counts in aggregator.directory_rollup(depth).items():
+        counts = {key: value for key, value in counts.items()
+                  if key != 'terms'}
+        rollups.append(({'rollup': 'directory', 'directory': directory},
+                        counts))
+    return rollups
+
+
+# Deterministic sampling on the fingerprint, so a given occurrence is
+# either always or never sent at a given rate. `key` returns the
+# fingerprint of an item.
+def sample_events(events, rate, key=lambda event: event['fingerprint']):
+    if rate >= 1:
+        return events
+    threshold = int(rate * 0xffffffff)
+    return [event for event in events
+            if int(key(event)[:8], 16) < threshold]
+
+
+def send_rollup_batch(rollups, batch_info, repo_name, source_type,
+                      event2splunk, metrics_index=None):
+    for dimensions, counts in rollups:
+        if metrics_index:
+            fields = dict(dimensions, uuid=batch_info['uuid'])
+            for key, value in counts.items():
+                fields[f'metric_name:{METRIC_PREFIX}{key}'] = value
+            event2splunk.post_metric(
+                fields, index=metrics_index, filename=constants.ROLLUP_CONTENT,
+                source=repo_name, sourcetype=source_type)
+        else:
+            payload = {'content': constants.ROLLUP_CONTENT}
+            payload.update(batch_info)
+            payload.update(dimensions)
+            payload.update(counts)
+            event2splunk.post_event(
+                payload=payload, filename=constants.ROLLUP_CONTENT,
+                source=repo_name, sourcetype=source_type)
+    event2splunk.close(constants.ROLLUP_CONTENT)
@@ -0,0 +1,210 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import os
+import subprocess
+import zlib
+import constants
+
+WORD_COUNT_KEYS = ['num_matched_lines',
+                   'num_matched_words', 'num_matched_files']
+
+
+# '2/4' -> (2, 4). Shards are numbered from 1 so the values line up with
+# CI matrix job indexes.
+def parse_shard(shard):
+    try:
+        index, count = (int(value) for value in shard.split('/'))
+    except ValueError:
+        raise Exception(f'Invalid shard "{shard}", expected i/N')
+    if count < 1 or not 1 <= index <= count:
+        raise Exception(f'Invalid shard "{shard}", expected 1 <= i <= N')
+    return index, count
+
+
+# crc32 rather than hash() so every CI node agrees on the partitioning
+def in_shard(relative_path, index, count):
+    return zlib.crc32(relative_path.encode('utf-8')) % count == index - 1
+
+
+# (path, stat) of the files of shard `shard`, an (index, count) pair, or
+# of every file when it is None, as the walker finds them
+def walk_shard(path, shard=None, extra_ignores=()):
+    from .walker import Walker
+    root_len = len(path.rstrip('/')) + 1
+    for file, stat in Walker(path, extra_ignores=extra_ignores):
+        if shard is None or in_shard(file[root_len:], *shard):
+            yield file, stat
+
+
+# Lists the searchable files under path with the same ignore rules as
+# rg_search and keeps the ones that belong to this shard. `extra_ignores`
+# are exclusions rg gets as globs instead of through the .rgignore.
+# rg only applies --max-filesize to the files it finds itself, so larger
+# files are left out here.
+def list_shard_files(path, index, count, extra_ignores=(), max_file_size=None):
+    limit = parse_file_size(max_file_size) if max_file_size else None
+    return [file for file, stat in walk_shard(path, (index, count), extra_ignores)
+            if (limit is None or stat.st_size <= limit) and is_searchable(file)]
+
+
+# rg's --max-filesize format: a number of bytes, optionally followed by
+# K, M or G
+def parse_file_size(size):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    try:
+        if size[-1:].upper() in units:
+            return int(size[:-1]) * units[size[-1].upper()]
+        return int(size)
+    except ValueError:
+        raise Exception(f'Invalid file size "{size}"')
+
+
+# rg skips the binary files it finds by itself but searches the ones it
+# is given by name, so explicit file lists must leave them out
+def is_searchable(file):
+    try:
+        with open(file, 'rb') as fp:
+            return b'\0' not in fp.read(constants.BINARY_CHECK_LEN)
+    except OSError:
+        return False
+
+
+# Whether there are exclude files below the root. rg can't read them, so
+# the search then has to be given the walked files. rg's own walk finds
+# them far quicker than walking the tree in Python.
+def has_nested_excludes(path):
+    output = subprocess.run(
+        ['rg', '--files', '--hidden', '--glob', constants.EXCLUDE_FILE, '--', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8').stdout
+    root_file = os.path.join(path, constants.EXCLUDE_FILE)
+    return any(file != root_file for file in output.splitlines())
+
+
+# Splits the file list into chunks that stay well below ARG_MAX
+def chunk_files(files, max_args_len):
+    chunk, chunk_len = [], 0
+    for file in files:
+        if chunk and chunk_len + len(file) + 1 > max_args_len:
+            yield chunk
+            chunk, chunk_len = [], 0
+        chunk.append(file)
+        chunk_len += len(file) + 1
+    if chunk:
+        yield chunk
+
+
+# Folds the rg 'summary' entries of several rg invocations into one so
+# the output reads like a single search.
+def combine_rg_summaries(summaries):
+    stats = {'matched_lines': 0, 'matches': 0}
+    for summary in summaries:
+        for key, value in summary['data']['stats'].items():
+            if isinstance(value, int):
+                stats[key] = stats.get(key, 0) + value
+    return {'type': 'summary', 'data': {'stats': stats}}
+
+
+def merge_directories(summaries):
+    directories = {}
+    for summary in summaries:
+        for directory, counts in summary.get('directories', {}).items():
+            entry = directories.setdefault(directory, {
+                'num_matched_files': 0,
+                'num_matched_lines': 0,
+                'num_matched_words': 0,
+                'terms': {}
+            })
+            for key in WORD_COUNT_KEYS:
+                entry[key] += counts[key]
+            for word, lines in counts['terms'].items():
+                entry['terms'][word] = entry['terms'].get(word, 0) + lines
+    return directories
+
+
+def check_shards(summaries):
+    shards = [summary.get('shard') for summary in summaries]
+    if None in shards:
+        raise Exception('Only summaries produced with --shard can be merged')
+    parsed = [parse_shard(shard) for shard in shards]
+    count = parsed[0][1]
+    conflicting = [shard for shard, (_, total) in zip(shards, parsed) if total != count]
+    if conflicting:
+        raise Exception(f'Shard counts differ: {shards[0]} vs {", ".join(conflicting)}')
+    indexes = sorted(index for index, _ in parsed)
+    if indexes != list(range(1, count + 1)):
+        raise Exception(
+            f'Expected shards 1..{count} exactly once, got {", ".join(shards)}')
+
+
+# Combines the partial summaries of a sharded run into the summary a
+# single run over the whole repo would have written. Shards never share
+# files, so the per-word counts add up. A shard stopped early by a cap or
+# a budget still lists every term, the union is taken all the same.
+def merge_summaries(summaries):
+    check_shards(summaries)
+    merged = {'biased_words': []}
+    all_files = set()
+    for summary in summaries:
+        merged['biased_words'] += [word for word in summary['biased_words']
+                                   if word not in merged['biased_words']]
+    for word in merged['biased_words']:
+        parts = [summary[word] for summary in summaries if summary.get(word)]
+        if not parts:
+            merged[word] = {}
+            continue
+        merged[word] = {'biased_word': word}
+        for key in WORD_COUNT_KEYS:
+            merged[word][key] = sum(part[key] for part in parts)
+        if any('num_suppressed_lines' in part for part in parts):
+            merged[word]['num_suppressed_lines'] = sum(
+                part.get('num_suppressed_lines', 0) for part in parts)
+        for flag in ('max_matches_reached', 'incomplete'):
+            if any(part.get(flag) for part in parts):
+                merged[word][flag] = True
+        # each shard lists its own files in rg's order, which isn't fixed
+        merged[word]['files'] = sorted(file for part in parts
+                                       for file in part['files'])
+        all_files.update(merged[word]['files'])
+
+    merged['terms_found'] = any(summary['terms_found']
+                                for summary in summaries)
+    merged['total_lines_matched'] = sum(
+        summary['total_lines_matched'] for summary in summaries)
+    merged['total_words_matched'] = sum(
+        summary['total_words_matched'] for summary in summaries)
+    merged['total_files_matched'] = len(all_files)
+    for key in ('total_lines_suppressed', 'total_lines_consolidated'):
+        if any(key in summary for summary in summaries):
+            merged[key] = sum(summary.get(key, 0) for summary in summaries)
+    for flag in ('max_matches_reached', 'incomplete'):
+        if any(summary.get(flag) for summary in summaries):
+            merged[flag] = True
+    for key in ('limits_hit', 'terms_not_searched'):
+        if any(key in summary for summary in summaries):
+            merged[key] = []
+            for summary in summaries:
+                merged[key] += [value for value in summary.get(key, [])
+                                if value not in merged[key]]
+    if any('directories' in summary for summary in summaries):
+        merged['directories'] = merge_directories(summaries)
+    return merged
+
+
+# Ordered by file and line, like the per-term `files` of the summary
+def merge_codeclimate(reports):
+    return sorted((occurrence for report in reports for occurrence in report),
+                  key=lambda occurrence: (occurrence['location']['path'],
+                                          occurrence['location']['lines']['begin'],
+                                          occurrence['description']))
@@ -0,0 +1,73 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import math
+
+# A truncated line never holds more than this many context windows
+MAX_SNIPPETS = 5
+MAX_SNIPPETS_MSG = 'Max length of lines reached...'
+ELLIPSIS = '...'
+
+
+# Converts ripgrep submatches (byte offsets into the raw, unstripped line)
+# into character offsets into the stripped line. Only the first `limit`
+# submatches are converted, everything past that is never displayed.
+def get_match_offsets(submatches, raw_line, limit=MAX_SNIPPETS):
+    offsets = []
+    leading = len(raw_line) - len(raw_line.lstrip())
+    encoded = None if raw_line.isascii() else raw_line.encode('utf-8')
+    for submatch in submatches[:limit]:
+        start, end = submatch['start'], submatch['end']
+        if encoded is not None:
+            start = len(encoded[:start].decode('utf-8', 'ignore'))
+            end = len(encoded[:end].decode('utf-8', 'ignore'))
+        offsets.append((max(start - leading, 0), max(end - leading, 0)))
+    return offsets
+
+
+# Case-insensitive literal search for biased_word. Used when no match
+# offsets are available, e.g. when the caller only has the line text.
+def find_literal_offsets(line, biased_word, limit=MAX_SNIPPETS):
+    offsets = []
+    if not biased_word:
+        return offsets
+    haystack, needle = line.lower(), biased_word.lower()
+    start = haystack.find(needle)
+    while start != -1 and len(offsets) < limit:
+        offsets.append((start, start + len(needle)))
+        start = haystack.find(needle, start + len(needle))
+    return offsets
+
+
+# Builds the '...context...' windows around each match. The padding is
+# sized so a single window fits within max_line_len.
+def truncate_line(line, biased_word, max_line_len=150, offsets=None):
+    if offsets is None:
+        offsets = find_literal_offsets(line, biased_word)
+    line_result = []
+    max_line_len -= len(ELLIPSIS)*2
+    total_line_len = max_line_len - len(biased_word)
+    padding = math.floor(total_line_len/2)
+    for match_start, match_end in offsets:
+        # Adding padding before and after banned_word so total len = 150
+        start = max(match_start - padding, 0)
+        end = min(match_end + padding, len(line))
+
+        line_result.append(f'{ELLIPSIS}{line[start:end]}{ELLIPSIS}')
+
+        if (len(line_result) == MAX_SNIPPETS):
+            line_result.append(MAX_SNIPPETS_MSG)
+            break
+
+    return '\n'.join(line_result)
@@ -0,0 +1,162 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import os
+import re
+import sqlite3
+import constants
+from .shard import parse_file_size
+
+# Files larger than this are not indexed and are always searched
+MAX_INDEXED_SIZE = 1024 * 1024
+# terms using any of these are patterns rather than literals
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+# Only the trigrams of runs of word characters are kept, which keeps the
+# index small: the runs of a term lie within the runs of any match.
+WORD_RUN = re.compile(rb'[a-z0-9_]{3,}')
+# rg -i folds these into ASCII letters: 'ſ' (U+017F) matches s and the
+# Kelvin sign (U+212A) matches k
+CASE_FOLDS = ((b'\xc5\xbf', b's'), (b'\xe2\x84\xaa', b'k'))
+# rg transcodes UTF-16 files that start with a BOM before searching them
+UTF16_BOMS = (b'\xff\xfe', b'\xfe\xff')
+# bumped whenever the stored trigrams change meaning
+INDEX_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER,
+    size INTEGER,
+    -- 0 when the file's trigrams aren't stored and it is always a candidate
+    indexed INTEGER
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram BLOB NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trigrams_file ON trigrams (file_id);
+'''
+
+
+def get_trigrams(data):
+    for code_point, letter in CASE_FOLDS:
+        data = data.replace(code_point, letter)
+    trigrams = set()
+    for run in WORD_RUN.findall(data.lower()):
+        trigrams.update(run[i:i+3] for i in range(len(run) - 2))
+    return trigrams
+
+
+# Persistent index of the lowercased byte trigrams of the words of every
+# file of a repo. A term can only match in files holding all of its trigrams, so
+# rg only needs to search those. Files are re-read when their mtime or
+# size changed since the last update.
+class TrigramIndex(object):
+    def __init__(self, db_path, root):
+        self._root = root
+        self._connection = sqlite3.connect(db_path)
+        if self._connection.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+            # built by an older version, read everything again
+            self._connection.executescript(
+                'DROP TABLE IF EXISTS trigrams; DROP TABLE IF EXISTS files;')
+            self._connection.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def relative_path(self, path):
+        if path.startswith(self._root + '/'):
+            return path[len(self._root)+1:]
+        return path
+
+    # `entries` are the (path, stat) pairs of every file to search, as the
+    # Walker yields them. Files above max_file_size (rg's format) aren't
+    # read. Returns the number of files (re)indexed, or None when
+    # `out_of_time` stopped the update: what was indexed is kept for the
+    # next run but this one can't rely on the index.
+    def update(self, entries, max_file_size=None, out_of_time=None):
+        max_size = MAX_INDEXED_SIZE
+        if max_file_size:
+            max_size = min(max_size, parse_file_size(max_file_size))
+        known = {row[0]: row[1:] for row in self._connection.execute(
+            'SELECT path, id, mtime_ns, size FROM files')}
+        current = set()
+        updated = 0
+        with self._connection:
+            for file, stat in entries:
+                if out_of_time is not None and out_of_time():
+                    return None
+                path = self.relative_path(file)
+                current.add(path)
+                file_id, mtime_ns, size = known.get(path, (None, None, None))
+                if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+                    continue
+                if file_id is not None:
+                    self._connection.execute(
+                        'DELETE FROM trigrams WHERE file_id = ?', (file_id,))
+                self._index_file(file, path, file_id, stat, max_size)
+                updated += 1
+            for path, (file_id, _, _) in known.items():
+                if path not in current:
+                    self._connection.execute(
+                        'DELETE FROM trigrams WHERE file_id = ?', (file_id,))
+                    self._connection.execute(
+                        'DELETE FROM files WHERE id = ?', (file_id,))
+        return updated
+
+    def _index_file(self, file, path, file_id, stat, max_size):
+        trigrams = None
+        try:
+            with open(file, 'rb') as fp:
+                data = fp.read(constants.BINARY_CHECK_LEN)
+                if data.startswith(UTF16_BOMS):
+                    # its bytes aren't the text rg searches
+                    pass
+                elif b'\0' in data:
+                    # rg doesn't search binary files either, not even
+                    # the ones too large to index
+                    trigrams = set()
+                elif stat.st_size <= max_size:
+                    trigrams = get_trigrams(data + fp.read())
+        except OSError:
+            pass
+        cursor = self._connection.execute(
+            'INSERT OR REPLACE INTO files (id, path, mtime_ns, size, indexed) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (file_id, path, stat.st_mtime_ns, stat.st_size, trigrams is not None))
+        if trigrams:
+            self._connection.executemany(
+                'INSERT INTO trigrams (trigram, file_id) VALUES (?, ?)',
+                ((trigram, cursor.lastrowid) for trigram in trigrams))
+
+    # Files that may contain `term`, prefixed with the root like rg --files
+    # prints them. None when the index can't narrow the search down: the
+    # term is a pattern, not ASCII (rg folds the case of non-ASCII letters
+    # the index doesn't know about) or has no run of three word characters.
+    def candidates(self, term):
+        if not term.isascii() or any(char in REGEX_CHARS for char in term):
+            return None
+        trigrams = list(get_trigrams(term.encode('utf-8')))
+        if not trigrams:
+            return None
+        placeholders = ', '.join('?' * len(trigrams))
+        rows = self._connection.execute(
+            'SELECT path FROM files WHERE indexed = 0 OR id IN ('
+            f'SELECT file_id FROM trigrams WHERE trigram IN ({placeholders}) '
+            'GROUP BY file_id HAVING COUNT(*) = ?) ORDER BY path',
+            trigrams + [len(trigrams)])
+        return [os.path.join(self._root, row[0]) for row in rows]
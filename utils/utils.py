@@ -12,27 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License
 
-from binaryornot.check import is_binary
 from copy import copy
 import csv
 from datetime import datetime
 import json
 import logging
-import logging.config
-import math
 import os
-import re
 import socket
 import time
 import uuid
 import urllib.parse
 
-binaryornot_logger = logging.getLogger('binaryornot')
-binaryornot_logger.setLevel('ERROR')
-chardet_logger = logging.getLogger('chardet')
-chardet_logger.setLevel('ERROR')
 
-def get_hec_info(token, endpoint):
+def get_hec_info(token, endpoint, ack=False):
     if not token:
         raise Exception('Missing Splunk HEC token')
     if endpoint is None:
@@ -47,6 +39,7 @@ def get_hec_info(token, endpoint):
         'hec_key': f'Splunk {token}',
         'hec_index': 'bias_language',
         'hec_protocol': 'https',
+        'hec_ack': ack,
     }
 
 
@@ -79,26 +72,6 @@ def get_batch_info():
     }
 
 
-def truncate_line(line, biased_word, max_line_len=150):
-    line_result = []
-    max_line_len -= len('...')*2
-    total_line_len = max_line_len - len(biased_word)
-    for match in re.finditer(biased_word, line, re.IGNORECASE):
-        padding = math.floor(total_line_len/2)
-
-        # Adding padding before and after banned_word so total len = 150
-        start = max(match.start() - padding, 0)
-        end = min(match.end() + padding, len(line))
-
-        line_result.append(f'...{line[start:end]}...')
-
-        if (len(line_result) == 5):
-            line_result.append('Max length of lines reached...')
-            break
-
-    return '\n'.join(line_result)
-
-
 def get_source_type(url=None):
     return urllib.parse.urlparse(url).netloc or 'local-' + socket.gethostname()
 
@@ -143,6 +116,17 @@ def copy_file_and_add_exclusions(src_file, dest_file, excluded):
     return excluded_copy
 
 
+# Same list process_and_return_exclusions builds, but without writing
+# an .rgignore into the scanned repo
+def read_exclusions(path, exclude_file):
+    excluded = ['.git', 'node_modules', '__pycache__']
+    bl_exclude_filepath = f'{path}/{exclude_file}'
+    if exclude_file and os.path.exists(bl_exclude_filepath):
+        with open(bl_exclude_filepath, 'r') as bl:
+            excluded += [line.strip() for line in bl if line.strip()]
+    return excluded
+
+
 # This func will copy contents from exclude_file arg into a new
 # .rgignore file for ripgrep library to exclude from search.
 # The excluded list is pre-populated with known dirs to exclude.
@@ -161,31 +145,41 @@ def process_and_return_exclusions(path, exclude_file, rgignore_file):
     return excluded
 
 
-# Add up the line count, but first it will update the nested dir values
-# in the excluded list to the path after the last '/'
-# This can be problematic for files of the same name in different dirs
-# so the line count here would be a rough estimate
-def get_line_count(path, excluded):
-    excluded_copy = copy(excluded)
-    def last_path(a): return a.rsplit('/', 1)[1]
-    for i in range(len(excluded_copy)):
-        if '/' in excluded_copy[i]:
-            excluded_copy[i] = last_path(excluded_copy[i])
-    return add_lines(path, excluded_copy)
+# Add up the line count of the files rg searches, with the `excluded`
+# patterns on top of the ignore files. The files are counted as the
+# walker finds them, the ones rg skips for max_file_size aren't. None
+# when `out_of_time` says to stop first.
+def get_line_count(path, excluded, max_file_size=None, out_of_time=None):
+    return add_lines(path, excluded, max_file_size, out_of_time)
+
+
+# binaryornot (and chardet behind it) is slow to import and only needed
+# for the line count, so it is loaded on first use
+def get_is_binary():
+    from binaryornot.check import is_binary
+    logging.getLogger('binaryornot').setLevel('ERROR')
+    logging.getLogger('chardet').setLevel('ERROR')
+    return is_binary
+
+
+def add_lines(path, excluded, max_file_size=None, out_of_time=None):
+    from .walker import Walker
+    from .shard import parse_file_size
+    limit = parse_file_size(max_file_size) if max_file_size else None
+    return count_lines((file for file, stat in Walker(path, extra_ignores=excluded)
+                        if limit is None or stat.st_size <= limit), out_of_time)
 
 
-def add_lines(path, excluded):
+def count_lines(files, out_of_time=None):
+    is_binary = get_is_binary()
     line_count = 0
-    for name in os.listdir(path):
-        if name in excluded:
+    for file in files:
+        if out_of_time is not None and out_of_time():
+            return None
+        if is_binary(file):
             continue
-        file = os.path.join(path, name)
-        if os.path.isfile(file) and not is_binary(file):
-            with open(file, 'rb') as f:
-                source = f.readlines()
-                line_count += len(source)
-        elif os.path.isdir(file):
-            line_count += add_lines(file, excluded)
+        with open(file, 'rb') as f:
+            line_count += sum(1 for _ in f)
     return line_count
 
 
@@ -248,7 +242,7 @@ class BiasedLanguageLogger:
         self._logger.info(msg)
 
     def warning(self, msg):
-        self._logger.warn(msg)
+        self._logger.warning(msg)
 
     def error(self, msg):
         self._logger.error(msg)
@@ -0,0 +1,261 @@
+# Copyright 2021 Splunk Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import constants
+
+# Ignore files read in every directory, highest precedence first like rg
+# does. The exclude file is the linter's own and only the walker knows
+# about nested ones, rg only sees the root one through the .rgignore.
+IGNORE_FILES = (constants.RGIGNORE_FILE, constants.EXCLUDE_FILE, '.ignore')
+GIT_IGNORE_FILE = '.gitignore'
+GIT_EXCLUDE_FILE = os.path.join('.git', 'info', 'exclude')
+# rg checks each kind of ignore file in turn: a match in any .rgignore or
+# .ignore wins over every .gitignore, whatever their depth. Patterns
+# given explicitly (extra_ignores, rg's --ignore-file) come last.
+PRECEDENCE = {constants.RGIGNORE_FILE: 0, constants.EXCLUDE_FILE: 0, '.ignore': 1,
+              GIT_IGNORE_FILE: 2, os.path.basename(GIT_EXCLUDE_FILE): 3, None: 4}
+
+
+def translate_pattern(pattern):
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i-1] == '/'):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i) and i + 2 == len(pattern) and \
+                (i == 0 or pattern[i-1] == '/'):
+            regex += '.*'
+            break
+        if char == '*':
+            while i + 1 < len(pattern) and pattern[i+1] == '*':
+                i += 1
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                negated = pattern[i+1] in '!^'
+                body = pattern[i+2 if negated else i+1:end].replace('\\', '\\\\')
+                regex += ('[^' if negated else '[') + body + ']'
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+# One line of a gitignore-style file, None for blanks and comments
+def parse_pattern(line):
+    line = line.rstrip('\r\n')
+    while line.endswith(' ') and not line.endswith('\\ '):
+        line = line[:-1]
+    if not line or line.startswith('#'):
+        return None
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith('\\'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    # a slash anywhere but at the end anchors the pattern to its directory
+    anchored = '/' in line
+    regex = translate_pattern(line.lstrip('/'))
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return re.compile(regex), negated, dir_only
+
+
+# The patterns of one ignore file (or an explicit list of them), which
+# apply to the paths below `base`.
+class IgnoreMatcher(object):
+    def __init__(self, base, lines, source=None):
+        self.base = base
+        self.source = source
+        self.precedence = PRECEDENCE[source]
+        self._patterns = [pattern for pattern in map(parse_pattern, lines)
+                          if pattern is not None]
+
+    @classmethod
+    def from_file(cls, base, file):
+        try:
+            with open(file, 'r', errors='replace') as fp:
+                return cls(base, fp.readlines(), os.path.basename(file))
+        except OSError:
+            return None
+
+    def __bool__(self):
+        return bool(self._patterns)
+
+    # True when ignored, False when whitelisted by a '!' pattern and None
+    # when no pattern matches. The last matching pattern wins.
+    def match(self, relative_path, is_dir):
+        for regex, negated, dir_only in reversed(self._patterns):
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(relative_path):
+                return not negated
+        return None
+
+
+# Puts the matchers in the order is_ignored checks them: by kind of
+# ignore file, then deeper files first since they override the ones of
+# their parents. Files of a directory keep their relative order.
+def order_matchers(matchers):
+    return sorted(matchers, key=lambda matcher: (matcher.precedence,
+                                                 -len(matcher.base)))
+
+
+# `matchers` as ordered by order_matchers, the first match decides
+def is_ignored(matchers, path, is_dir):
+    for matcher in matchers:
+        relative_path = path[len(matcher.base)+1:] if matcher.base != '/' \
+            else path[1:]
+        result = matcher.match(relative_path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+
+def read_ignore_files(directory, in_git, is_git_root=False, names=IGNORE_FILES):
+    names = names + ((GIT_IGNORE_FILE,) if in_git else ())
+    matchers = [IgnoreMatcher.from_file(directory, os.path.join(directory, name))
+                for name in names]
+    if is_git_root:
+        matchers.append(IgnoreMatcher.from_file(
+            directory, os.path.join(directory, GIT_EXCLUDE_FILE)))
+    return [matcher for matcher in matchers if matcher]
+
+
+# Lists the files under `root` with rg's ignore rules: .rgignore, .ignore
+# and, inside a git repo, .gitignore and .git/info/exclude files apply
+# to their directory and everything below it, including the ones in the
+# parents of `root`. Nested .biased_lang_exclude files are honoured too.
+# Directories are scanned in parallel with os.scandir and (path, stat)
+# pairs of regular files are yielded as they come, the paths start with
+# `root` like `rg --files` prints them. `extra_ignores` are patterns
+# relative to `root`, with the lowest precedence like rg --ignore-file.
+class Walker(object):
+    def __init__(self, root, hidden=True, follow_symlinks=False,
+                 extra_ignores=(), max_workers=None):
+        self._root = root.rstrip('/') or '/'
+        self._abs_root = os.path.abspath(self._root)
+        self._hidden = hidden
+        self._follow_symlinks = follow_symlinks
+        self._extra_ignores = extra_ignores
+        self._max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        # whether an exclude file below the root was found, rg can't see
+        # those so the search has to be given the walked files
+        self.nested_excludes = False
+
+    def __iter__(self):
+        root = self._abs_root
+        matchers, in_git = self._parent_matchers(root)
+        if self._extra_ignores:
+            matchers.append(IgnoreMatcher(root, self._extra_ignores))
+        matchers = order_matchers(matchers)
+        try:
+            root_stat = os.stat(root)
+        except OSError:
+            return
+        pending = deque()
+        with ThreadPoolExecutor(self._max_workers) as executor:
+            pending.append(executor.submit(
+                self._scan, root, matchers, in_git,
+                ((root_stat.st_dev, root_stat.st_ino),)))
+            try:
+                while pending:
+                    files, directories = pending.popleft().result()
+                    for arguments in directories:
+                        pending.append(executor.submit(self._scan, *arguments))
+                    for path, stat in files:
+                        yield self._root + path[len(root):], stat
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    # The ignore files of the directories above `root`, and whether it is
+    # inside a git repo
+    def _parent_matchers(self, root):
+        parents = []
+        directory = root
+        while directory != os.path.dirname(directory):
+            directory = os.path.dirname(directory)
+            parents.append(directory)
+        git_root = None
+        for directory in [root] + parents:
+            if os.path.exists(os.path.join(directory, '.git')):
+                git_root = directory
+                break
+        matchers = []
+        for directory in reversed(parents):
+            in_git = git_root is not None and \
+                (directory.rstrip('/') + '/').startswith(git_root.rstrip('/') + '/')
+            # exclude files only count from the root down
+            matchers += read_ignore_files(
+                directory, in_git, directory == git_root,
+                tuple(name for name in IGNORE_FILES if name != constants.EXCLUDE_FILE))
+        return matchers, git_root is not None
+
+    def _scan(self, directory, matchers, in_git, ancestors):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            return [], []
+        names = {entry.name for entry in entries}
+        is_git_root = '.git' in names
+        in_git = in_git or is_git_root
+        if is_git_root or not names.isdisjoint(IGNORE_FILES + (GIT_IGNORE_FILE,)):
+            local = read_ignore_files(directory, in_git, is_git_root)
+            if directory != self._abs_root and any(
+                    matcher.source == constants.EXCLUDE_FILE for matcher in local):
+                self.nested_excludes = True
+            matchers = order_matchers(matchers + local)
+        files, directories = [], []
+        for entry in entries:
+            if not self._hidden and entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_symlink() and not self._follow_symlinks:
+                    continue
+                is_dir = entry.is_dir()
+                if not is_dir and not entry.is_file():
+                    continue
+                if is_ignored(matchers, entry.path, is_dir):
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            if not is_dir:
+                files.append((entry.path, stat))
+            elif (stat.st_dev, stat.st_ino) not in ancestors:
+                # a followed symlink looping back to a parent is skipped
+                directories.append((entry.path, matchers, in_git,
+                                    ancestors + ((stat.st_dev, stat.st_ino),)))
+        return files, directories